@@ -0,0 +1,262 @@
+"""
+Aggregating, batched SQLite writer for alerts.
+
+Detection threads call put(), which never blocks: alerts go into a bounded
+queue and are dropped (and counted) if it is full. A single writer thread
+drains the queue and owns everything after it.
+
+During a flood the same (src_ip, dst_ip, dst_port, attack_type) is detected
+over and over. Those detections are folded into one open incident in
+memory (first_seen, last_seen, hit_count, max confidence) and written on a
+schedule: every flush_interval (or within new_delay of a new incident),
+new incidents are inserted and incidents that were hit again are updated
+in place, all in one transaction. Write
+volume follows the number of distinct incidents, not raw detections.
+
+Open incidents are kept in an LRU: one that gets no new detection for
+`ttl` seconds is closed (a later detection starts a new row), and past
+max_incidents the least recently hit one is closed early.
+
+The writer also runs storage maintenance (retention.maintain) every
+maintenance_interval: sealing the day's partition after midnight, rolling
+it up and dropping expired partitions. Open incidents are closed at a
+seal, so an incident never spans two partitions.
+
+The connection is long-lived and in WAL mode, so web_app.py (and anything
+else) can read ids_logs.db while a batch is written; the busy timeout
+covers the rare moment another writer (attack.py, a checkpoint) holds the
+write lock.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+import metrics
+import retention
+from setup_db import init_db
+
+DB_PATH = 'ids_logs.db'
+FLUSH_INTERVAL = 2.0   # how often incidents that were hit again are written
+NEW_DELAY = 0.2        # a new incident is written within this long (reaches the dashboard quickly)
+TTL = 60.0             # an incident with no detection for this long is closed
+MAX_INCIDENTS = 50000  # open incidents kept in memory
+QUEUE_SIZE = 100000    # alerts waiting for the writer
+BUSY_TIMEOUT = 5.0     # seconds to wait for another writer's lock
+MAINTENANCE_INTERVAL = 60.0  # how often partitions are sealed / dropped
+CLOSE_POLL = 0.5       # close(): how often to check the writer is still alive while the queue is full
+
+COMMIT_SECONDS = metrics.histogram('phoenix_alert_commit_seconds', "Alert writer transaction time per flush")
+MAINTENANCE_SECONDS = metrics.histogram('phoenix_alert_maintenance_seconds',
+                                        "Partition sealing / retention time per run")
+
+_INSERT = '''
+    INSERT INTO alerts (timestamp, last_seen, hit_count, src_ip, dst_ip, src_port, dst_port,
+                        attack_type, confidence)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+_UPDATE = 'UPDATE alerts SET last_seen = ?, hit_count = ?, confidence = ? WHERE id = ?'
+
+
+def connect(db_path=DB_PATH, timeout=BUSY_TIMEOUT):
+    """Connection in WAL mode; synchronous=NORMAL only syncs at checkpoints, WAL keeps it consistent."""
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class _Incident:
+    """Repeated detections of one (src_ip, dst_ip, dst_port, attack_type)."""
+
+    __slots__ = ('key', 'src_port', 'first_seen', 'last_seen', 'hits', 'confidence',
+                 'last_hit', 'row_id', 'dirty')
+
+    def __init__(self, key, src_port, seen, confidence, now):
+        self.key = key
+        self.src_port = src_port
+        self.first_seen = self.last_seen = seen
+        self.hits = 1
+        self.confidence = confidence
+        self.last_hit = now   # monotonic, for the TTL
+        self.row_id = None    # alerts.id once inserted
+        self.dirty = False    # has changes not yet written
+
+
+class AlertWriter:
+    def __init__(self, db_path=DB_PATH, flush_interval=FLUSH_INTERVAL, ttl=TTL,
+                 max_incidents=MAX_INCIDENTS, queue_size=QUEUE_SIZE, new_delay=NEW_DELAY,
+                 raw_days=retention.RAW_DAYS, minute_days=retention.MINUTE_DAYS,
+                 hour_days=retention.HOUR_DAYS, maintenance_interval=MAINTENANCE_INTERVAL):
+        self.db_path = db_path
+        self.retention = {"raw_days": raw_days, "minute_days": minute_days, "hour_days": hour_days}
+        self.maintenance_interval = maintenance_interval
+        self.flush_interval = flush_interval
+        self.new_delay = new_delay
+        self.ttl = ttl
+        self.max_incidents = max_incidents
+        self._q = queue.Queue(queue_size)
+        self._thread = None
+        # Writer thread only
+        self._open = OrderedDict()  # key -> _Incident, least recently hit first
+        self._dirty = []            # incidents to write at the next flush
+        # put() counters (detection threads)
+        self.queued = 0   # accepted
+        self.dropped = 0  # queue was full
+        # Writer counters
+        self.inserted = 0  # incident rows created
+        self.updated = 0   # incident rows refreshed
+        self.failed = 0    # incident writes lost to a database error
+        self.error = None  # why the database could not be opened (the writer has stopped)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, src_ip, dst_ip, src_port, dst_port, attack_type, confidence):
+        """Queues one alert (same arguments as the detector's alert tuples). Never blocks."""
+        if self.error is not None:
+            self.dropped += 1
+            return False
+        # Stamp detection time now (same format as the column's CURRENT_TIMESTAMP default),
+        # not whenever the incident happens to be written
+        row = (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+               src_ip, dst_ip, src_port, dst_port, attack_type, float(confidence))
+        try:
+            self._q.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.queued += 1
+        return True
+
+    def backlog(self):
+        """Detections queued and not yet aggregated."""
+        return self._q.qsize()
+
+    def close(self):
+        """Writes everything still queued or open and stops the writer thread."""
+        if self._thread is not None:
+            # A full queue only drains while the writer runs: don't wait on one that has stopped
+            while self._thread.is_alive():
+                try:
+                    self._q.put(None, timeout=CLOSE_POLL)
+                    break
+                except queue.Full:
+                    pass
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            init_db(self.db_path)
+            conn = connect(self.db_path)
+        except (sqlite3.Error, OSError) as e:
+            self.error = e
+            print(f"❌ Alert writer cannot open {self.db_path}: {e} (alerts will be dropped)")
+            return
+        get, now = self._q.get, time.monotonic
+        next_flush = now() + self.flush_interval
+        next_maintenance = now()
+        reported = 0
+        try:
+            while True:
+                try:
+                    row = get(timeout=max(next_flush - now(), 0))
+                except queue.Empty:
+                    row = ()
+                if row is None:
+                    break
+                if row and self._aggregate(row):
+                    next_flush = min(next_flush, now() + self.new_delay)
+                if now() >= next_flush:
+                    self._flush(conn)
+                    next_flush = now() + self.flush_interval
+                    if self.dropped != reported:
+                        reported = self.dropped
+                        print(f"⚠️ Alert writer backlog: {reported} alerts dropped so far")
+                    if now() >= next_maintenance:
+                        self._maintain(conn)
+                        next_maintenance = now() + self.maintenance_interval
+        finally:
+            self._flush(conn, close_all=True)
+            conn.close()
+
+    def _maintain(self, conn):
+        """Runs right after a flush, so no incident has unwritten changes."""
+        try:
+            with MAINTENANCE_SECONDS.time():
+                sealed, dropped = retention.maintain(conn, **self.retention)
+        except Exception as e:
+            print(f"❌ Retention Error: {e}")
+            return
+        if sealed:
+            # Its rows now live in the sealed partition: later hits start new incidents
+            self._open.clear()
+            print(f"🗄️ Sealed alert partition {sealed}")
+        if dropped:
+            print(f"🗑️ Dropped expired alert partitions: {', '.join(dropped)}")
+
+    def _aggregate(self, row):
+        """Folds one detection into its incident. Returns True if it opened a new one."""
+        seen, src_ip, dst_ip, src_port, dst_port, attack_type, confidence = row
+        key = (src_ip, dst_ip, dst_port, attack_type)
+        incident = self._open.get(key)
+        if incident is None:
+            incident = self._open[key] = _Incident(key, src_port, seen, confidence, time.monotonic())
+            if len(self._open) > self.max_incidents:
+                self._open.popitem(last=False)  # still written if dirty: _dirty holds it
+        else:
+            self._open.move_to_end(key)
+            incident.last_seen = seen
+            incident.hits += 1
+            incident.last_hit = time.monotonic()
+            if confidence > incident.confidence:
+                incident.confidence = confidence
+        if not incident.dirty:
+            incident.dirty = True
+            self._dirty.append(incident)
+        return incident.hits == 1
+
+    def _flush(self, conn, close_all=False):
+        # Close incidents past their TTL (the LRU order makes them a prefix)
+        open_incidents = self._open
+        cutoff = time.monotonic() - self.ttl
+        while open_incidents:
+            incident = next(iter(open_incidents.values()))
+            if not close_all and incident.last_hit > cutoff:
+                break
+            del open_incidents[incident.key]
+
+        dirty, self._dirty = self._dirty, []
+        if not dirty:
+            return
+        for incident in dirty:
+            incident.dirty = False
+        new = [i for i in dirty if i.row_id is None]
+        old = [i for i in dirty if i.row_id is not None]
+        try:
+            with COMMIT_SECONDS.time(), conn:
+                conn.executemany(_INSERT, [(i.first_seen, i.last_seen, i.hits, *i.key[:2],
+                                            i.src_port, *i.key[2:], i.confidence) for i in new])
+                # This transaction holds the write lock, so the AUTOINCREMENT ids are consecutive
+                last = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                row_ids = range(last - len(new) + 1, last + 1)
+                conn.executemany(_UPDATE, [(i.last_seen, i.hits, i.confidence, i.row_id) for i in old])
+        except sqlite3.Error as e:
+            # Totals stay in memory: an incident that is hit again is written in full then
+            self.failed += len(dirty)
+            print(f"❌ DB Error: {e} ({len(dirty)} incidents not written)")
+            return
+        for incident, row_id in zip(new, row_ids):
+            incident.row_id = row_id
+        self.inserted += len(new)
+        self.updated += len(old)
+
+        if new:
+            counts = Counter(i.key[3] for i in new)
+            summary = ", ".join(f"{n} {attack}" for attack, n in counts.most_common())
+            print(f"🚨 LOGGED: {len(new)} new incidents ({summary}), {len(old)} updated")
+        elif old:
+            print(f"🚨 LOGGED: {len(old)} incidents updated")
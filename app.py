@@ -1,11 +1,11 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import joblib
-import xgboost as xgb
 import matplotlib.pyplot as plt
 import seaborn as sns
 import time
+import os
+from flow_features import COLUMNS
+from model_server import load_detector
 
 # ==========================================
 # 1. SETUP & CONFIGURATION
@@ -39,17 +39,15 @@ st.markdown("""
 @st.cache_resource
 def load_assets():
     try:
-        # Load the files you downloaded from Colab
-        model = joblib.load('xgboost_final.pkl')
-        scaler = joblib.load('scaler_final.pkl')
-        le = joblib.load('label_encoder_final.pkl')
-        return model, scaler, le
+        # Native XGBoost model + folded scaler (exported from the Colab pickles on first run),
+        # or the shared model server (web_app.py) when PHOENIX_MODEL_SERVER is set
+        return load_detector(os.environ.get('PHOENIX_MODEL_SERVER'))
     except Exception as e:
         st.error(f"❌ Error loading model files: {e}")
         st.error("Please make sure 'xgboost_final.pkl', 'scaler_final.pkl', and 'label_encoder_final.pkl' are in the same folder.")
-        return None, None, None
+        return None
 
-model, scaler, le = load_assets()
+detector = load_assets()
 
 # ==========================================
 # 3. SIDEBAR (INPUTS)
@@ -97,7 +95,7 @@ st.divider()
 # ==========================================
 # 5. PREDICTION LOGIC
 # ==========================================
-if model and st.button("🚀 Analyze Traffic Pattern"):
+if detector and st.button("🚀 Analyze Traffic Pattern"):
     
     with st.spinner('Scanning packet structure...'):
         time.sleep(0.5) # Dramatic effect
@@ -106,30 +104,17 @@ if model and st.button("🚀 Analyze Traffic Pattern"):
         # IMPORTANT: We must match the exact 78 features expected by the model.
         # Since we only have 5 sliders, we will pad the rest with zeros (Prototype Limitation).
         # In a real deployed app, you would pass the full CSV row here.
+        input_data = np.zeros((1, len(COLUMNS)))
         
-        # Get expected number of features from scaler
-        n_features = scaler.n_features_in_
-        
-        # Create a dummy array with zeros
-        input_data = np.zeros((1, n_features))
-        
-        # Fill in the values we know (first 5 columns just for demo)
-        # Note: This is a simplification. To be accurate, you need to map inputs to specific indices.
-        # For this demo, we assume the first 5 features map to our inputs.
-        values = list(feature_inputs.values())
-        for i, val in enumerate(values):
-            if i < n_features:
-                input_data[0, i] = val
+        # Fill in the values we know, by feature name
+        for name, val in feature_inputs.items():
+            input_data[0, COLUMNS.index(name)] = val
                 
-        # 2. Scale Data
-        input_scaled = scaler.transform(input_data)
-        
-        # 3. Predict
-        prediction_index = model.predict(input_scaled)[0]
-        prediction_label = le.inverse_transform([prediction_index])[0]
+        # 2. Scale + Predict (one call)
+        probs = detector.probabilities(input_data)[0]
+        prediction_label = detector.labels[probs.argmax()]
         
-        # 4. Get Probability (Confidence)
-        probs = model.predict_proba(input_scaled)[0]
+        # 3. Get Probability (Confidence)
         confidence = np.max(probs) * 100
         
         # ==========================================
@@ -154,7 +139,7 @@ if model and st.button("🚀 Analyze Traffic Pattern"):
         with c2:
             # Plot Probability Distribution
             fig, ax = plt.subplots()
-            sns.barplot(x=le.classes_, y=probs, ax=ax, palette="viridis")
+            sns.barplot(x=detector.labels, y=probs, ax=ax, palette="viridis")
             plt.xticks(rotation=90)
             plt.ylabel("Probability")
             plt.title("AI Prediction Confidence")
@@ -0,0 +1,78 @@
+"""
+Bulk scoring throughput (bulk_score.py) in rows/s.
+
+    python -m benchmarks.bulk --rows 2000000 [--chunk-rows 100000 200000] [--parquet]
+
+Writes a CICIDS2017-format CSV (all 78 COLUMNS with the dataset's leading
+spaces, plus Label) built from synthetic flows with jittered values, then
+scores it with score_file() for each chunk size and reports rows/s with
+the read / model / write split. --parquet does the same from a Parquet
+copy (needs pyarrow). An existing --csv with enough rows is reused.
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import bulk_score
+from flow_features import COLUMNS
+from inference import Detector, feature_matrix
+from benchmarks.inference import random_flows
+
+TEMPLATES = 20000  # distinct synthetic flows the rows are drawn from
+
+
+def write_csv(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    base = feature_matrix(random_flows(TEMPLATES, seed))
+    header = True
+    for start in range(0, rows, bulk_score.CHUNK_ROWS):
+        n = min(bulk_score.CHUNK_ROWS, rows - start)
+        X = base[rng.integers(0, len(base), n)] * rng.uniform(0.9, 1.1, (n, len(COLUMNS)))
+        chunk = pd.DataFrame(X, columns=[f" {c}" for c in COLUMNS])
+        chunk[" Label"] = "BENIGN"
+        chunk.to_csv(path, mode='w' if header else 'a', header=header, index=False,
+                     float_format=bulk_score.FLOAT_FORMAT)
+        header = False
+
+
+def count_rows(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk scoring throughput benchmark")
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--chunk-rows', type=int, nargs='+', default=[20000, 100000, 500000])
+    parser.add_argument('--csv', default=os.path.join(tempfile.gettempdir(), 'bench_flows.csv'))
+    parser.add_argument('--parquet', action='store_true', help="also score a Parquet copy")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv) or count_rows(args.csv) < args.rows:
+        start = time.perf_counter()
+        write_csv(args.csv, args.rows)
+        print(f"wrote {args.rows:,} rows in {time.perf_counter() - start:.1f}s")
+    print(f"{os.path.getsize(args.csv) / 2**20:,.0f} MiB CSV")
+
+    sources = [args.csv]
+    if args.parquet:
+        path = os.path.splitext(args.csv)[0] + '.parquet'
+        pd.read_csv(args.csv).to_parquet(path)  # fine at benchmark sizes; needs pyarrow
+        sources.append(path)
+
+    detector = Detector(cache_size=0)
+    out = os.path.join(tempfile.gettempdir(), 'bench_scores.csv')
+    for source in sources:
+        for chunk_rows in args.chunk_rows:
+            start = time.perf_counter()
+            stats = bulk_score.score_file(source, out, detector, chunk_rows)
+            elapsed = time.perf_counter() - start
+            print(f"{os.path.basename(source):>20} chunk {chunk_rows:>7,}: {stats['rows'] / elapsed:>9,.0f} rows/s   "
+                  f"(read {stats['read']:.1f}s, model {stats['score']:.1f}s, write {stats['write']:.1f}s)")
+    os.remove(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+/api/data latency against a large alerts table.
+
+    python -m benchmarks.dashboard --alerts 10000000 [--db /tmp/bench_alerts.db]
+
+Seeds the database through setup_db's schema (indexes and summary
+triggers active, so seeding also measures insert cost), then times the
+previous endpoint body (fresh connection, full-table COUNT/AVG/GROUP BY)
+against web_app.query_data (reused connection, summary table) and the
+cached path taken by unchanged polls (web_app.cached_data). An existing
+--db with enough rows is reused instead of seeded again.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from setup_db import init_db
+import web_app
+
+ATTACK_TYPES = ("Bots", "Brute Force", "DDoS", "DoS", "Port Scanning", "Web Attacks")
+CHUNK = 100000
+
+
+def seed(db_path, n, seed=1):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    have = conn.execute('SELECT COUNT(*) FROM alerts').fetchone()[0]
+    start = time.perf_counter()
+    for done in range(have, n, CHUNK):
+        rows = [(f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                 "192.168.1.100", rng.randrange(1024, 65536), rng.choice((22, 80, 443, 3389)),
+                 rng.choice(ATTACK_TYPES), rng.uniform(50, 100), rng.randrange(1, 50))
+                for _ in range(min(CHUNK, n - done))]
+        with conn:
+            conn.executemany('''
+                INSERT INTO alerts (src_ip, dst_ip, src_port, dst_port, attack_type, confidence, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+    conn.close()
+    return max(n - have, 0), time.perf_counter() - start
+
+
+def legacy_get_data(db_path):
+    """The endpoint body before the summary table."""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT timestamp, attack_type, src_ip, dst_ip, dst_port, confidence FROM alerts ORDER BY id DESC LIMIT 10")
+    c.fetchall()
+    c.execute("SELECT COUNT(*), AVG(confidence) FROM alerts")
+    c.fetchone()
+    c.execute("SELECT attack_type, COUNT(*) FROM alerts GROUP BY attack_type")
+    c.fetchall()
+    conn.close()
+
+
+def measure(fn, polls):
+    times = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard endpoint latency benchmark")
+    parser.add_argument('--alerts', type=int, default=10000000)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'bench_alerts.db'))
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--legacy-polls', type=int, default=5, help="the full scans are slow")
+    args = parser.parse_args()
+
+    init_db(args.db)
+    inserted, elapsed = seed(args.db, args.alerts)
+    if inserted:
+        print(f"seeded {inserted:,} alerts in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s)")
+    print(f"{os.path.getsize(args.db) / 2**20:,.0f} MiB database")
+
+    web_app.DB_PATH = args.db
+    conn = web_app.connect_ro()
+    for name, fn, polls in (("before (full scans)", lambda: legacy_get_data(args.db), args.legacy_polls),
+                            ("after (summary table)", lambda: web_app.query_data(conn.cursor()), args.polls),
+                            ("unchanged poll (cached)", web_app.cached_data, args.polls)):
+        median, p99 = measure(fn, polls)
+        print(f"{name:>24}: median {median * 1e3:9.2f} ms   p99 {p99 * 1e3:9.2f} ms   ({polls} polls)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+End-to-end pipeline benchmark with machine-readable results.
+
+    python -m benchmarks.e2e [--flows 100000] [--scenarios benign syn_flood] [--out run.json]
+                             [--compare previous.json --tolerance 0.1]
+
+Writes one synthetic capture per scenario (cached in the temp directory):
+
+  - benign:     closed TCP conversations and DNS exchanges
+  - syn_flood:  benign traffic plus unanswered SYNs from a few sources
+  - port_scan:  benign traffic plus SYN scans of 1024 ports (answered RST)
+  - many_flows: 4x the flows, never closed: they pile up in the flow table
+                until the idle timeout
+
+and replays it, each stage in a fresh interpreter so peak RSS is its own:
+
+  - parse:      pcap_reader.read_packets only
+  - flow_table: parse + FlowTable, swept every second of capture time
+  - pipeline:   replay through sniffer_service (rules, features, model, cache)
+                with alerts written by the AlertWriter to a scratch database
+
+Each stage reports packets/s, flows/s and peak RSS; the pipeline stage also
+reports p50/p99 detection latency per flow (capture time from the flow's
+last packet to the sweep that hands it out, plus the wall time of scoring
+that sweep; flows only ended by the final flush are left out), p50/p99
+scoring time (wall time of score_flows() on one sweep's finished flows),
+the feature / model / commit time from the metrics registry, flows per
+rule and the cache hit rate. The JSON (stdout,
+or --out) carries the git commit and machine so runs can be compared:
+--compare prints the change against an earlier file and exits with status 1
+when a throughput drops, or a latency or RSS grows, by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks import synth
+
+DURATION = 90.0  # capture seconds each scenario spans (longer than the idle timeout)
+SCAN_PORTS = 1024
+STAGES = ('parse', 'flow_table', 'pipeline')
+
+# (stage, key, True when higher is better) compared by --compare
+TRACKED = (('parse', 'packets_per_s', True), ('flow_table', 'packets_per_s', True),
+           ('flow_table', 'peak_rss_mib', False), ('pipeline', 'packets_per_s', True),
+           ('pipeline', 'detection_p50_ms', False), ('pipeline', 'detection_p99_ms', False),
+           ('pipeline', 'scoring_p50_ms', False), ('pipeline', 'scoring_p99_ms', False),
+           ('pipeline', 'peak_rss_mib', False))
+
+
+def _benign(flows, seed, close=True):
+    return synth.generate(flows, seed, rate=flows / DURATION, close=close)
+
+
+def _syn_flood(flows, seed):
+    return synth.merge(_benign(flows // 2, seed),
+                       synth.syn_flood(flows, seed + 1, rate=flows / DURATION, attackers=4))
+
+
+def _port_scan(flows, seed):
+    scans = max(1, flows // (2 * SCAN_PORTS))
+    return synth.merge(_benign(flows // 2, seed),
+                       *(synth.port_scan(SCAN_PORTS, seed + 1 + i, start=i * DURATION / scans,
+                                         target=synth.SERVER_NET | (1 + i % 254))
+                         for i in range(scans)))
+
+
+def _many_flows(flows, seed):
+    return _benign(4 * flows, seed, close=False)
+
+
+SCENARIOS = {'benign': _benign, 'syn_flood': _syn_flood, 'port_scan': _port_scan, 'many_flows': _many_flows}
+
+
+def capture(name, flows, seed):
+    """Path of the scenario's pcap, written on first use."""
+    path = os.path.join(tempfile.gettempdir(), f"phoenix_e2e_{name}_{flows}_{seed}.pcap")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        synth.write_pcap(tmp, SCENARIOS[name](flows, seed))
+        os.replace(tmp, path)
+    return path
+
+
+def _peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _parse(path):
+    from pcap_reader import read_packets
+    packets = sum(1 for _ in read_packets(path))
+    return {"packets": packets}
+
+
+def _flow_table(path):
+    from flow_table import FlowTable
+    from pcap_reader import replay
+    flows = 0
+
+    def on_finished(finished):
+        nonlocal flows
+        flows += len(finished)
+    packets = replay([path], FlowTable(), on_finished)  # default timeouts and 1 s sweeps, as sniffer_service
+    return {"packets": packets, "flows": flows}
+
+
+def _pipeline(path, use_rules=True):
+    import metrics
+    import rules
+    import sniffer_service
+    from alert_writer import AlertWriter
+    from inference import CACHE_SIZE, CACHE_BITS
+    from pcap_reader import replay
+
+    db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db.close()
+    sniffer_service.alert_writer = AlertWriter(db.name).start()
+    sniffer_service.load_models(cache_size=CACHE_SIZE, cache_bits=CACHE_BITS,
+                                rules=rules.RuleStage() if use_rules else None)
+    detector = sniffer_service.detector
+    table = sniffer_service.flow_table
+    latencies, detections, flows = [], [], 0
+    sweep = None  # capture time of the sweep being scored; None for the final flush
+    expire, flush = table.expire, table.flush
+
+    def timed_expire(now):
+        nonlocal sweep
+        sweep = now
+        return expire(now)
+
+    def timed_flush():
+        nonlocal sweep
+        sweep = None
+        return flush()
+    table.expire, table.flush = timed_expire, timed_flush
+
+    def on_finished(finished):
+        nonlocal flows
+        flows += len(finished)
+        start = time.perf_counter()
+        sniffer_service.score_flows(finished)
+        if finished:
+            scoring = time.perf_counter() - start
+            latencies.append(scoring)
+            if sweep is not None:
+                detections.extend(sweep - flow.last_ts / 1e6 + scoring for _, flow in finished)
+
+    start = time.perf_counter()
+    packets = replay([path], table, on_finished, sniffer_service.ANALYSIS_INTERVAL)
+    writer = sniffer_service.alert_writer
+    writer.close()  # the run includes writing every alert out
+    elapsed = time.perf_counter() - start
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db.name + suffix):
+            os.remove(db.name + suffix)
+
+    snapshot = metrics.REGISTRY.snapshot()
+    result = {"packets": packets, "flows": flows, "seconds": elapsed,
+              "windows": len(latencies),
+              "detection_p50_ms": _percentile(detections, 0.50) * 1e3,
+              "detection_p99_ms": _percentile(detections, 0.99) * 1e3,
+              "scoring_p50_ms": _percentile(latencies, 0.50) * 1e3,
+              "scoring_p99_ms": _percentile(latencies, 0.99) * 1e3,
+              "scoring_max_ms": max(latencies, default=0.0) * 1e3,
+              "feature_s": snapshot['phoenix_feature_seconds'][1],
+              "model_s": snapshot['phoenix_inference_seconds'][1],
+              "commit_s": snapshot['phoenix_alert_commit_seconds'][1],
+              "detections": writer.queued, "incidents": writer.inserted, "alerts_dropped": writer.dropped}
+    if detector.rules is not None:
+        result["rules"] = dict(detector.rules.counts)
+    if detector.cache is not None:
+        result["cache_hit_rate"] = detector.cache.hit_rate()
+    return result
+
+
+def run_stage(stage, path, use_rules=True):
+    """Runs one stage in this process; returns its result dict."""
+    base_rss = _peak_rss_mib()
+    start = time.perf_counter()
+    if stage == 'parse':
+        result = _parse(path)
+    elif stage == 'flow_table':
+        result = _flow_table(path)
+    else:
+        result = _pipeline(path, use_rules)
+    result.setdefault("seconds", time.perf_counter() - start)
+    seconds = max(result["seconds"], 1e-9)
+    result["packets_per_s"] = result["packets"] / seconds
+    if "flows" in result:
+        result["flows_per_s"] = result["flows"] / seconds
+    result["base_rss_mib"] = base_rss
+    result["peak_rss_mib"] = _peak_rss_mib()
+    return result
+
+
+def spawn_stage(stage, path, use_rules):
+    command = [sys.executable, '-m', 'benchmarks.e2e', '--stage', stage, '--pcap', path]
+    if not use_rules:
+        command.append('--no-rules')
+    out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])  # sniffer_service prints its own progress
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous, current, tolerance):
+    """Prints the change of each TRACKED figure; returns the regressions beyond tolerance."""
+    regressions = []
+    for name, scenario in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        for stage, key, higher_is_better in TRACKED:
+            old = before.get("stages", {}).get(stage, {}).get(key)
+            new = scenario["stages"].get(stage, {}).get(key)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"{name:>11} {stage:>10} {key:>15}: {old:>12,.2f} -> {new:>12,.2f} ({change:+.1%}){flag}",
+                  file=sys.stderr)
+            if flag:
+                regressions.append((name, stage, key))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark (JSON results)")
+    parser.add_argument('--flows', type=int, default=100000, help="benign conversations per scenario")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--no-rules', action='store_true', help="run the pipeline without the rule stage")
+    parser.add_argument('--out', help="write the JSON here instead of stdout")
+    parser.add_argument('--compare', metavar='JSON', help="earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative change counted as a regression by --compare")
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)  # child process
+    parser.add_argument('--pcap', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(run_stage(args.stage, args.pcap, not args.no_rules)))
+        return
+
+    results = {"meta": {"time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), "commit": _git_commit(),
+                        "python": platform.python_version(), "machine": platform.machine(),
+                        "cpu_count": os.cpu_count(), "flows": args.flows, "seed": args.seed,
+                        "rules": not args.no_rules},
+               "scenarios": {}}
+    for name in args.scenarios:
+        path = capture(name, args.flows, args.seed)
+        stages = {}
+        for stage in args.stages:
+            stages[stage] = spawn_stage(stage, path, not args.no_rules)
+            print(f"{name:>11} {stage:>10}: {stages[stage]['packets_per_s']:>11,.0f} pkts/s  "
+                  f"peak {stages[stage]['peak_rss_mib']:,.0f} MiB", file=sys.stderr)
+        results["scenarios"][name] = {"pcap_bytes": os.path.getsize(path), "stages": stages}
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(previous, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Flow table memory and throughput on a million synthetic flows.
+
+    python -m benchmarks.flow_table --flows 1000000 [--pcap synthetic.pcap]
+
+Compares the bidirectional FlowTable (int-packed keys) with the previous
+layout: a dict keyed by directional (src, dst, sport, dport, proto) tuples,
+where every reply opens a second flow. Each variant runs in a fresh process
+so peak RSS is comparable. Times exclude traffic generation (measured
+separately and subtracted).
+
+With --pcap the traffic is written to that capture and every variant
+reads it back with pcap_reader.read_packets instead: throughput then
+includes parsing the capture, as a --pcap replay of sniffer_service does
+(the parse-only rate is printed for reference, not subtracted).
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+from flow_features import FlowStats
+from flow_table import FlowTable
+from pcap_reader import read_packets
+from benchmarks import synth
+
+
+def _null(records):
+    for _ in records:
+        pass
+    return 0
+
+
+def _directional(records):
+    flows = {}
+    for src, dst, sport, dport, proto, ts, plen, hlen, flags, window in records:
+        key = (src, dst, sport, dport, proto)
+        flow = flows.get(key)
+        if flow is None:
+            flow = flows[key] = FlowStats(dport)
+        flow.update(ts, True, plen, hlen, flags, window)
+    return len(flows)
+
+
+def _bidirectional(records):
+    table = FlowTable()
+    add = table.add
+    for record in records:
+        add(*record)
+    return len(table)
+
+
+VARIANTS = {'source only': _null, 'directional tuples': _directional,
+            'bidirectional packed': _bidirectional}
+
+
+def _run(name, n_flows, pcap, results):
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    n = VARIANTS[name](read_packets(pcap) if pcap else synth.generate(n_flows))
+    elapsed = time.perf_counter() - t0
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((name, n, elapsed, (rss_after - rss_before) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flow table memory/throughput benchmark")
+    parser.add_argument('--flows', type=int, default=1000000)
+    parser.add_argument('--pcap', help="write the synthetic traffic to this pcap file and time reading it back")
+    args = parser.parse_args()
+
+    n_packets = sum(1 for _ in synth.generate(args.flows))
+    if args.pcap:
+        synth.write_pcap(args.pcap, synth.generate(args.flows))
+        print(f"wrote {args.pcap}")
+
+    results = multiprocessing.Queue()
+    base = 0.0
+    print(f"{args.flows} conversations, {n_packets} packets")
+    for name in VARIANTS:
+        p = multiprocessing.Process(target=_run, args=(name, args.flows, args.pcap, results))
+        p.start()
+        name, n, elapsed, rss_mb = results.get()
+        p.join()
+        if name == 'source only':
+            if args.pcap:  # parsing is part of the pcap figures, not subtracted
+                print(f"{'pcap parse only':22} {'':>15}  {n_packets / max(elapsed, 1e-9):>11,.0f} pkts/s")
+            else:
+                base = elapsed
+            continue
+        busy = max(elapsed - base, 1e-9)
+        print(f"{name:22} flows={n:>9}  {n_packets / busy:>11,.0f} pkts/s  "
+              f"+{rss_mb:,.0f} MB ({rss_mb * 1024 * 1024 / max(n, 1):,.0f} B/flow)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Per-flow vs batched inference throughput.
+
+    python -m benchmarks.inference --flows 20000
+
+The per-flow path reproduces the old process_flow loop on the training
+pickles (one-row DataFrame, scaler.transform, predict, inverse_transform,
+predict_proba per flow); the batched path is Detector.predict on one
+matrix for the whole window. Feature extraction is timed both for all of
+COLUMNS and for only the model's inputs (Detector.feature_matrix).
+
+The flood line scores a window where each flow is one of --distinct
+flows repeated (what a scan or flood looks like), with and without the
+prediction cache. The cache lines check that cached verdicts match the
+model's on every random flow, with exact keys (the default) and with
+--cache-bits quantized keys.
+"""
+import argparse
+import random
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from flow_features import COLUMNS, FlowStats, SYN, ACK
+from export_model import MODEL_PKL, SCALER_PKL, ENCODER_PKL
+from inference import Detector, feature_matrix
+
+
+def random_flows(n, seed=0):
+    """n synthetic flows of 2-20 packets with random sizes, gaps and flags."""
+    rng = random.Random(seed)
+    flows = []
+    for _ in range(n):
+        flow = FlowStats(rng.choice((22, 53, 80, 443, rng.randint(1, 65535))))
+        ts = rng.uniform(0, 3)
+        for _ in range(rng.randint(2, 20)):
+            ts += rng.expovariate(50)
+            flow.update(ts, rng.random() < 0.6, rng.randint(0, 1460), 20,
+                        rng.choice((SYN, ACK, ACK, 0x18)), rng.randint(0, 65535))
+        flows.append(flow)
+    return flows
+
+
+def per_flow(model, scaler, le, feature_index, X):
+    names = [COLUMNS[i] for i in feature_index]
+    alerts = 0
+    for row in X:
+        df_input = pd.DataFrame([row[feature_index]], columns=names)
+        input_scaled = scaler.transform(df_input)
+        pred_idx = model.predict(input_scaled)[0]
+        pred_label = le.inverse_transform([pred_idx])[0]
+        if pred_label not in ["BENIGN", "Normal Traffic"]:
+            probs = model.predict_proba(input_scaled)[0]
+            np.max(probs) * 100
+            alerts += 1
+    return alerts
+
+
+def flood(detector, flows, n, distinct):
+    """Scores n flows drawn from `distinct` templates; returns (seconds, alerts)."""
+    X = detector.feature_matrix(flows[i % distinct] for i in range(n))
+    start = time.perf_counter()
+    alerts = batched(detector, X)
+    return time.perf_counter() - start, alerts
+
+
+def batched(detector, X):
+    class_idx, confidence = detector.predict(X)
+    return int(detector.is_attack[class_idx].sum())
+
+
+def agreement(detector, cached, X):
+    """(rows where the cached class differs from the model's, max confidence difference)."""
+    expected, expected_conf = detector.predict(X)
+    cached.predict(X)  # fills the cache
+    class_idx, confidence = cached.predict(X)
+    return int((class_idx != expected).sum()), float(np.abs(confidence - expected_conf).max(initial=0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--flows', type=int, default=20000)
+    parser.add_argument('--per-flow-limit', type=int, default=2000,
+                        help="rows scored by the (slow) per-flow path")
+    parser.add_argument('--distinct', type=int, default=50,
+                        help="distinct flows in the flood window")
+    parser.add_argument('--cache-bits', type=int, default=6,
+                        help="quantized cache keys checked against the model")
+    args = parser.parse_args()
+
+    detector = Detector(cache_size=0)
+    model, scaler, le = joblib.load(MODEL_PKL), joblib.load(SCALER_PKL), joblib.load(ENCODER_PKL)
+    flows = random_flows(args.flows)
+
+    t0 = time.perf_counter()
+    X = feature_matrix(flows)
+    t_matrix = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    detector.feature_matrix(flows)
+    t_inputs = time.perf_counter() - t0
+
+    n_slow = min(args.per_flow_limit, len(X))
+    t0 = time.perf_counter()
+    per_flow(model, scaler, le, detector.feature_index, X[:n_slow])
+    t_slow = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    alerts = batched(detector, X)
+    t_fast = time.perf_counter() - t0
+
+    print(f"flows:              {len(X)}")
+    print(f"feature matrix:     {t_matrix * 1000:.1f} ms ({len(X) / t_matrix:,.0f} flows/s)")
+    print(f"model inputs only:  {t_inputs * 1000:.1f} ms ({len(X) / t_inputs:,.0f} flows/s, "
+          f"{int(detector.used.sum())} of {len(COLUMNS)} columns computed)")
+    print(f"per-flow inference: {n_slow / t_slow:,.0f} flows/s (on {n_slow} flows)")
+    print(f"batched inference:  {len(X) / t_fast:,.0f} flows/s ({alerts} alerts)")
+    print(f"speedup:            {(len(X) / t_fast) / (n_slow / t_slow):.1f}x")
+
+    cached = Detector()
+    t_flood, _ = flood(detector, flows, len(X), args.distinct)
+    t_cached, _ = flood(cached, flows, len(X), args.distinct)
+    print(f"flood, no cache:    {len(X) / t_flood:,.0f} flows/s ({args.distinct} distinct flows)")
+    print(f"flood, cached:      {len(X) / t_cached:,.0f} flows/s "
+          f"({cached.cache.hit_rate():.1%} hit rate, {t_flood / t_cached:.1f}x)")
+    for bits in (52, args.cache_bits):
+        differ, conf = agreement(detector, Detector(cache_bits=bits), X)
+        print(f"cache {bits:>2} bits:      {differ} of {len(X)} verdicts differ from the model "
+              f"(max confidence difference {conf:.2g})")
+
+
+if __name__ == "__main__":
+    main()
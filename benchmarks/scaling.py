@@ -0,0 +1,57 @@
+"""
+Scaling of the sharded detection pipeline with the number of worker processes.
+
+    python -m benchmarks.scaling --flows 200000 --workers 1 2 4 8 16 [--pcap capture.pcap]
+
+Replays the same capture (synthetic unless --pcap is given) through
+ShardedPipeline for each worker count and reports packets/s and the
+speedup over one worker. Model loading is excluded; alerts are counted,
+not written.
+"""
+import argparse
+import os
+import tempfile
+import time
+from sharding import ShardedPipeline
+from benchmarks import synth
+
+
+def run(paths, workers):
+    pipeline = ShardedPipeline(workers, lambda *alert: None, 60, 120, live=False)
+    pipeline.start()
+    start = time.perf_counter()
+    packets = pipeline.replay(paths)
+    return packets, time.perf_counter() - start, pipeline.alerts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded pipeline scaling benchmark")
+    parser.add_argument('--flows', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--pcap', nargs='+', help="capture files to replay instead of synthetic traffic")
+    args = parser.parse_args()
+
+    tmp = None
+    paths = args.pcap
+    if not paths:
+        tmp = tempfile.NamedTemporaryFile(suffix='.pcap', delete=False)
+        tmp.close()
+        synth.write_pcap(tmp.name, synth.generate(args.flows))
+        paths = [tmp.name]
+
+    try:
+        print(f"cores: {os.cpu_count()}")
+        base = None
+        for workers in args.workers:
+            packets, elapsed, alerts = run(paths, workers)
+            rate = packets / elapsed
+            base = base or rate
+            print(f"workers={workers:>3}  {rate:>11,.0f} pkts/s  speedup {rate / base:4.1f}x  "
+                  f"({packets} packets, {alerts} alerts, {elapsed:.1f}s)")
+    finally:
+        if tmp:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Synthetic traffic for benchmarks.
+
+generate() (a benign mix), syn_flood() and port_scan() yield parsed
+packet records
+
+    (src_ip, dst_ip, src_port, dst_port, proto, ts, payload_len, header_len, flags, window)
+
+with IPs as ints: the records capture.parse_packet() and pcap_reader
+produce, ready for FlowTable.add(*record). write_pcap() turns
+records into a classic libpcap file (Ethernet / IPv4 / TCP or UDP) that
+scapy, tcpdump or Wireshark can open. merge() interleaves several
+generators by timestamp to build a scenario.
+
+    python -m benchmarks.synth --flows 1000000 --out synthetic.pcap
+"""
+import argparse
+import heapq
+import random
+import struct
+from flow_features import SYN, ACK, PSH, FIN, RST
+
+CLIENT_NET = 0x0A000000  # 10.0.0.0/8
+SERVER_NET = 0xC0A80000  # 192.168.0.0/16
+SERVER_PORTS = (22, 53, 80, 443, 3306, 8080)
+
+_PCAP_HEADER = struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+_ETHERNET = b'\x02\x00\x00\x00\x00\x02' + b'\x02\x00\x00\x00\x00\x01' + b'\x08\x00'
+
+
+def generate(n_flows, seed=0, start=0.0, rate=100000.0, close=False):
+    """
+    n_flows short conversations starting at `rate` flows/s: TCP flows are a
+    handshake plus one request and one response, UDP flows a query and a reply.
+    Flows are emitted one after the other; with close=False no TCP flow is
+    closed (they stay in the flow table until a timeout), with close=True
+    each ends with a FIN exchange.
+    """
+    rng = random.Random(seed)
+    ts = start
+    for _ in range(n_flows):
+        ts += rng.expovariate(rate)
+        client = CLIENT_NET | rng.getrandbits(24)
+        server = SERVER_NET | rng.getrandbits(16)
+        sport = rng.randint(1024, 65535)
+        dport = rng.choice(SERVER_PORTS)
+        rtt = rng.uniform(0.0001, 0.05)
+        if dport == 53:
+            yield client, server, sport, dport, 17, ts, rng.randint(20, 60), 8, 0, -1
+            yield server, client, dport, sport, 17, ts + rtt, rng.randint(40, 512), 8, 0, -1
+            continue
+        yield client, server, sport, dport, 6, ts, 0, 40, SYN, 64240
+        yield server, client, dport, sport, 6, ts + rtt, 0, 40, SYN | ACK, 65160
+        yield client, server, sport, dport, 6, ts + 2 * rtt, rng.randint(50, 600), 32, PSH | ACK, 502
+        yield server, client, dport, sport, 6, ts + 3 * rtt, rng.randint(100, 1400), 32, PSH | ACK, 509
+        if close:
+            yield client, server, sport, dport, 6, ts + 4 * rtt, 0, 32, FIN | ACK, 502
+            yield server, client, dport, sport, 6, ts + 5 * rtt, 0, 32, FIN | ACK, 509
+
+
+def syn_flood(n_packets, seed=0, start=0.0, rate=100000.0, attackers=1, target=SERVER_NET | 100, port=80):
+    """Unanswered SYNs from `attackers` sources (random source ports): one single-packet flow each."""
+    rng = random.Random(seed)
+    sources = [CLIENT_NET | rng.getrandbits(24) for _ in range(attackers)]
+    ts = start
+    for _ in range(n_packets):
+        ts += rng.expovariate(rate)
+        yield rng.choice(sources), target, rng.randint(1024, 65535), port, 6, ts, 0, 40, SYN, 1024
+
+
+def port_scan(n_ports, seed=0, start=0.0, rate=10000.0, target=SERVER_NET | 200):
+    """One source SYN-scanning ports 1..n_ports of `target`; closed ports answer RST/ACK."""
+    rng = random.Random(seed)
+    scanner = CLIENT_NET | rng.getrandbits(24)
+    sport = rng.randint(1024, 65535)
+    ts = start
+    for port in range(1, n_ports + 1):
+        ts += rng.expovariate(rate)
+        yield scanner, target, sport, port, 6, ts, 0, 40, SYN, 1024
+        yield target, scanner, port, sport, 6, ts + 0.0002, 0, 40, RST | ACK, 0
+
+
+def merge(*generators):
+    """Interleaves record generators by timestamp."""
+    return heapq.merge(*generators, key=lambda record: record[5])
+
+
+def frame(record):
+    """Encodes one record as an Ethernet frame (payload bytes are zeros)."""
+    src, dst, sport, dport, proto, ts, payload_len, header_len, flags, window = record
+    if proto == 6:
+        l4 = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, (header_len // 4) << 4, flags,
+                         max(window, 0), 0, 0) + bytes(header_len - 20)
+    else:
+        l4 = struct.pack('!HHHH', sport, dport, 8 + payload_len, 0)
+    total = 20 + len(l4) + payload_len
+    ip = struct.pack('!BBHHHBBHII', 0x45, 0, total, 0, 0, 64, proto, 0, src, dst)
+    return _ETHERNET + ip + l4 + bytes(payload_len)
+
+
+def write_pcap(path, records):
+    """Writes records to a libpcap file. Returns the number of packets written."""
+    n = 0
+    with open(path, 'wb') as f:
+        f.write(_PCAP_HEADER)
+        for record in records:
+            data = frame(record)
+            ts = record[5]
+            sec = int(ts)
+            f.write(struct.pack('<IIII', sec, int((ts - sec) * 1000000), len(data), len(data)))
+            f.write(data)
+            n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic pcap")
+    parser.add_argument('--flows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='synthetic.pcap')
+    args = parser.parse_args()
+    n = write_pcap(args.out, generate(args.flows, args.seed))
+    print(f"wrote {n} packets ({args.flows} flows) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
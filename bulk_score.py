@@ -0,0 +1,246 @@
+"""
+Bulk scoring of CICIDS2017-format flow exports (CSV or Parquet).
+
+    python bulk_score.py flows.csv [--out scores.csv] [--chunk-rows 100000]
+
+The file is streamed in chunks of chunk_rows rows: only the model's input
+columns (and Label, if present) are parsed, each chunk is scored with one
+multiply-add and one Booster.inplace_predict (inference.Detector), and
+its predictions are written out before the next chunk is read. Memory
+follows the chunk size, not the file size.
+
+Column names are matched after stripping spaces (the CICIDS2017 CSVs have
+" Destination Port"); infinite values (Flow Bytes/s of zero-duration
+flows) are scored as missing. The output has one row per input row:
+label, confidence (percent), one probability per class and, when the
+input has a Label column, label_true. Its format follows the extension:
+.parquet, or CSV (.csv.gz is compressed). Parquet needs pyarrow, which is
+not in requirements.txt.
+
+web_app.py serves the same scoring as POST /api/score.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from inference import Detector
+
+CHUNK_ROWS = 100000
+LABEL_COLUMN = 'Label'
+FLOAT_FORMAT = '%.6g'
+
+
+def is_parquet(name):
+    return str(name).lower().endswith(('.parquet', '.pq'))
+
+
+def _pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet files need pyarrow (pip install pyarrow)") from None
+    return pq
+
+
+def _check_columns(chunk, columns):
+    missing = [c for c in columns if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+
+
+def read_chunks(source, columns, chunk_rows=CHUNK_ROWS, name=None):
+    """
+    Yields DataFrames of up to chunk_rows rows holding `columns` (plus Label
+    when present), with stripped column names. source is a path or a binary
+    file object (then `name` tells the format). Raises ValueError on the
+    first chunk if a column is missing.
+    """
+    name = str(name or getattr(source, 'name', source))
+    wanted = set(columns) | {LABEL_COLUMN}
+    if is_parquet(name):
+        pq = _pyarrow_parquet()
+        f = pq.ParquetFile(source)
+        names = [n for n in f.schema_arrow.names if n.strip() in wanted]
+        for batch in f.iter_batches(batch_size=chunk_rows, columns=names):
+            chunk = batch.to_pandas().rename(columns=str.strip)
+            _check_columns(chunk, columns)
+            yield chunk
+        return
+    reader = pd.read_csv(source, usecols=lambda n: n.strip() in wanted, chunksize=chunk_rows,
+                         compression='gzip' if name.lower().endswith('.gz') else None)
+    with reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns=str.strip)
+            _check_columns(chunk, columns)
+            yield chunk
+
+
+def score_chunk(detector, chunk):
+    """Predictions for one chunk: label, confidence, p_<class>... (and label_true)."""
+    X = chunk[detector.features].to_numpy(dtype=np.float64)
+    X[np.isinf(X)] = np.nan  # XGBoost treats NaN as missing
+    probs = detector.probabilities(X)
+    class_idx = probs.argmax(axis=1)
+    result = pd.DataFrame(probs, columns=[f"p_{label}" for label in detector.labels])
+    result.insert(0, "label", detector.labels[class_idx])
+    result.insert(1, "confidence", probs[np.arange(len(class_idx)), class_idx] * 100)
+    if LABEL_COLUMN in chunk.columns:
+        result["label_true"] = chunk[LABEL_COLUMN].to_numpy()
+    return result
+
+
+def _csv_field(value):
+    if value != value:  # NaN
+        return ''
+    value = str(value)
+    return '"' + value.replace('"', '""') + '"' if any(ch in value for ch in ',"\r\n') else value
+
+
+def csv_text(result, header=True):
+    """
+    CSV text of a result frame. %-formatting whole rows is several times
+    faster than DataFrame.to_csv, which made writing the bottleneck.
+    """
+    formats, columns = [], []
+    for name in result.columns:
+        values = result[name]
+        if values.dtype.kind == 'f':
+            formats.append(FLOAT_FORMAT)
+            columns.append(values.to_numpy().tolist())
+        else:
+            fields = {}  # a handful of distinct labels: escape each once
+            formats.append('%s')
+            columns.append([fields[v] if v in fields else fields.setdefault(v, _csv_field(v))
+                            for v in values.tolist()])
+    row = ','.join(formats) + '\n'
+    head = ','.join(_csv_field(name) for name in result.columns) + '\n' if header else ''
+    return head + ''.join([row % values for values in zip(*columns)])
+
+
+@contextmanager
+def open_writer(out):
+    """
+    Yields write(result_frame) appending to `out`: a .parquet / .csv /
+    .csv.gz path, or a text file object (CSV).
+    """
+    if hasattr(out, 'write'):
+        first = [True]
+
+        def write(result):
+            out.write(csv_text(result, first[0]))
+            first[0] = False
+        yield write
+        return
+
+    tmp = f"{out}.{os.getpid()}.tmp"  # a failed run never leaves a truncated file behind
+    writer = None
+    try:
+        if is_parquet(out):
+            pq = _pyarrow_parquet()
+            import pyarrow as pa
+
+            def write(result):
+                nonlocal writer
+                table = pa.Table.from_pandas(result, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table)
+        else:
+            writer = gzip.open(tmp, 'wt', newline='') if out.endswith('.gz') else open(tmp, 'w', newline='')
+            first = [True]
+
+            def write(result):
+                writer.write(csv_text(result, first[0]))
+                first[0] = False
+        yield write
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp, out)
+
+
+def score_file(source, out, detector=None, chunk_rows=CHUNK_ROWS, name=None):
+    """
+    Scores `source` into `out` chunk by chunk. Returns stats: rows, read /
+    score / write seconds, predicted label counts, and agreement with
+    label_true over the rows whose Label is one of the model's classes.
+    """
+    detector = detector or Detector(cache_size=0)
+    classes = set(detector.labels)
+    stats = {"rows": 0, "read": 0.0, "score": 0.0, "write": 0.0,
+             "labels": Counter(), "comparable": 0, "agree": 0}
+    chunks = read_chunks(source, detector.features, chunk_rows, name)
+    with open_writer(out) as write:
+        while True:
+            t0 = time.perf_counter()
+            chunk = next(chunks, None)
+            t1 = time.perf_counter()
+            if chunk is None:
+                break
+            result = score_chunk(detector, chunk)
+            t2 = time.perf_counter()
+            write(result)
+            t3 = time.perf_counter()
+
+            stats["rows"] += len(result)
+            stats["read"] += t1 - t0
+            stats["score"] += t2 - t1
+            stats["write"] += t3 - t2
+            stats["labels"].update(result["label"].value_counts().to_dict())
+            if "label_true" in result.columns:
+                comparable = result["label_true"].isin(classes).to_numpy()
+                stats["comparable"] += int(comparable.sum())
+                stats["agree"] += int((result["label"].to_numpy() == result["label_true"].to_numpy())[comparable].sum())
+    return stats
+
+
+def default_output(source):
+    """flows.csv / flows.csv.gz / flows.parquet -> flows.scores.csv"""
+    root = source
+    for ext in ('.gz', '.csv', '.parquet', '.pq'):
+        if root.lower().endswith(ext):
+            root = root[:-len(ext)]
+    return f"{root}.scores.csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CICIDS2017-format CSV/Parquet flow export")
+    parser.add_argument('source', help="CSV (.csv, .csv.gz) or Parquet (.parquet) file")
+    parser.add_argument('--out', help="predictions file (.csv, .csv.gz or .parquet; '-' for stdout); "
+                                      "default: <source>.scores.csv")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows read and scored at a time")
+    args = parser.parse_args()
+
+    out = args.out or default_output(args.source)
+    if out == '-':
+        out = sys.stdout
+    start = time.perf_counter()
+    try:
+        stats = score_file(args.source, out, chunk_rows=args.chunk_rows)
+    except (ValueError, RuntimeError) as e:
+        parser.error(f"{args.source}: {e}")
+    elapsed = time.perf_counter() - start
+
+    report = sys.stderr if out is sys.stdout else sys.stdout
+    rows = stats["rows"]
+    print(f"✅ Scored {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s; "
+          f"read {stats['read']:.1f}s, model {stats['score']:.1f}s, write {stats['write']:.1f}s)", file=report)
+    for label, n in stats["labels"].most_common():
+        print(f"   {label}: {n:,}", file=report)
+    if stats["comparable"]:
+        print(f"   Agreement with Label: {stats['agree'] / stats['comparable']:.2%} "
+              f"(over {stats['comparable']:,} rows labelled with a model class)", file=report)
+
+
+if __name__ == "__main__":
+    main()
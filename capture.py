@@ -0,0 +1,136 @@
+"""
+Capture side of the pipeline.
+
+The sniff callback only parses the header fields the flow table needs and
+appends them to a PacketQueue; the analysis thread drains the queue, owns
+the flow table and runs inference. Nothing on the capture path waits on a
+lock, so a slow model call or a DB stall never back-pressures capture: the
+queue just grows, and past its bound packets are dropped and counted.
+
+Traffic the model never looks at is dropped in the kernel: a BPF filter
+(default "ip and (tcp or udp)", plus optional trusted subnet/port
+exclusions) is pushed into libpcap for scapy, or attached to the socket
+for the raw AF_PACKET path. The raw path also copies only the first
+`snaplen` bytes of each frame and parses them with the same header-only
+parser as the pcap reader.
+"""
+import ipaddress
+import socket
+import time
+from collections import deque
+from scapy.all import IP, TCP, UDP
+from flow_table import ip_to_int
+from pcap_reader import LINKTYPE_ETHERNET, parse_frame
+
+QUEUE_SIZE = 500000
+
+DEFAULT_FILTER = "ip and (tcp or udp)"
+# Ethernet + 2 VLAN tags + max IPv4 header + the TCP fields we read
+SNAPLEN = 128
+
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+RCVBUF_SIZE = 8 * 1024 * 1024
+
+
+def build_filter(base=DEFAULT_FILTER, exclude_nets=(), exclude_ports=()):
+    """
+    BPF filter expression: `base`, minus traffic to/from trusted subnets and ports.
+    Raises ValueError on malformed subnets or ports.
+    """
+    parts = [f"({base})"]
+    if exclude_nets:
+        nets = [str(ipaddress.ip_network(n, strict=False)) for n in exclude_nets]
+        parts.append("not (" + " or ".join(f"net {n}" for n in nets) + ")")
+    if exclude_ports:
+        ports = [int(p) for p in exclude_ports]
+        if any(not 0 <= p <= 65535 for p in ports):
+            raise ValueError(f"invalid port in {exclude_ports}")
+        parts.append("not (" + " or ".join(f"port {p}" for p in ports) + ")")
+    return " and ".join(parts)
+
+
+def parse_packet(packet):
+    """
+    Returns the FlowTable.add() arguments for an IPv4 TCP/UDP scapy packet:
+    (src_ip, dst_ip, src_port, dst_port, proto, ts, payload_len, header_len, flags, window)
+    or None for anything else.
+    """
+    if IP not in packet:
+        return None
+    ip = packet[IP]
+    if TCP in packet:
+        l4 = packet[TCP]
+        header_len, flags, window = l4.dataofs * 4, int(l4.flags), l4.window
+    elif UDP in packet:
+        l4 = packet[UDP]
+        header_len, flags, window = 8, 0, -1
+    else:
+        return None
+    # Payload length from the IP header (ignores Ethernet padding, works with short snaplens)
+    payload_len = max(ip.len - ip.ihl * 4 - header_len, 0)
+    return (ip_to_int(ip.src), ip_to_int(ip.dst), l4.sport, l4.dport, ip.proto,
+            float(packet.time), payload_len, header_len, flags, window)
+
+
+class PacketQueue:
+    """
+    Single-producer / single-consumer hand-off of parsed packets.
+
+    deque.append() and deque.popleft() are atomic in CPython, so neither
+    side takes a lock. Each counter is written by one thread only:
+    received/dropped by the capture thread, late by the analysis thread.
+    """
+
+    def __init__(self, maxlen=QUEUE_SIZE):
+        self.maxlen = maxlen
+        self._q = deque()
+        self.received = 0
+        self.dropped = 0  # queue was full
+        self.late = 0     # older than the last flow expiry sweep when drained
+
+    def __len__(self):
+        return len(self._q)
+
+    def put(self, record):
+        """Never blocks. Returns False if the record was dropped."""
+        self.received += 1
+        if len(self._q) >= self.maxlen:
+            self.dropped += 1
+            return False
+        self._q.append(record)
+        return True
+
+    def drain(self):
+        """Yields the records queued at the time of the call, oldest first."""
+        q = self._q
+        for _ in range(len(q)):
+            yield q.popleft()
+
+
+def raw_capture(on_record, iface=None, bpf_filter=DEFAULT_FILTER, snaplen=SNAPLEN):
+    """
+    Linux AF_PACKET capture without scapy dissection. The BPF filter runs in
+    the kernel, only `snaplen` bytes per frame are copied to user space, and
+    on_record() receives parsed records (as from parse_packet). Runs until
+    interrupted. Needs root / CAP_NET_RAW.
+    """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    try:
+        if bpf_filter:
+            # libpcap (through scapy) compiles the expression to classic BPF bytecode
+            from scapy.arch.common import compile_filter
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, compile_filter(bpf_filter, iface))
+        if iface:
+            sock.bind((iface, ETH_P_ALL))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+
+        buf = bytearray(snaplen)
+        recv_into, now = sock.recv_into, time.time
+        while True:
+            n = recv_into(buf, snaplen)
+            record = parse_frame(buf, 0, n, LINKTYPE_ETHERNET, now())
+            if record is not None:
+                on_record(record)
+    finally:
+        sock.close()
@@ -0,0 +1,110 @@
+"""
+Converts the pickled training artifacts into the files the detector loads.
+
+    python export_model.py
+
+xgboost_final.pkl (sklearn XGBClassifier), scaler_final.pkl and
+label_encoder_final.pkl become:
+  - xgboost_final.ubj: the booster in XGBoost's native binary format,
+  - model_meta.json:   feature names, the scaler folded into one
+                       multiply-add (x * scale + offset), which of the
+                       features the trees actually split on, and the labels.
+Loading those needs neither pickle, pandas nor scikit-learn objects, and
+the detector predicts straight from NumPy arrays (lower per-batch latency).
+It does not start faster: importing xgboost itself pulls in pandas and
+scikit-learn when they are installed (see benchmarks/startup.py).
+
+Runs automatically the first time the detector starts without them; only
+this conversion needs joblib / scikit-learn.
+"""
+import json
+import os
+import numpy as np
+
+MODEL_PKL = 'xgboost_final.pkl'
+SCALER_PKL = 'scaler_final.pkl'
+ENCODER_PKL = 'label_encoder_final.pkl'
+
+MODEL_PATH = 'xgboost_final.ubj'
+META_PATH = 'model_meta.json'
+
+
+def fold_scaler(scaler):
+    """
+    (scale, offset, clip) so that scaler.transform(X) == X * scale + offset
+    (clipped to clip if it is not None). Handles MinMaxScaler, StandardScaler
+    and RobustScaler.
+    """
+    n = scaler.n_features_in_
+    clip = None
+    if hasattr(scaler, 'min_'):  # MinMaxScaler: X * scale_ + min_
+        scale, offset = np.asarray(scaler.scale_, dtype=np.float64), np.asarray(scaler.min_, dtype=np.float64)
+        if getattr(scaler, 'clip', False):
+            clip = [float(v) for v in scaler.feature_range]
+        return scale, offset, clip
+
+    # StandardScaler: (X - mean_) / scale_ ; RobustScaler: (X - center_) / scale_
+    center = getattr(scaler, 'mean_', None)
+    if center is None:
+        center = getattr(scaler, 'center_', None)
+    center = np.zeros(n) if center is None else np.asarray(center, dtype=np.float64)
+    divisor = getattr(scaler, 'scale_', None)
+    divisor = np.ones(n) if divisor is None else np.asarray(divisor, dtype=np.float64)
+    return 1.0 / divisor, -center / divisor, clip
+
+
+def split_features(booster, n):
+    """Indices of the n model inputs that at least one tree splits on."""
+    names = booster.feature_names or [f'f{i}' for i in range(n)]
+    used = booster.get_score(importance_type='weight')  # only features with a split
+    return [i for i, name in enumerate(names) if name in used]
+
+
+def _replace(path, write):
+    """Writes through a temporary file so a concurrent reader never sees half a file."""
+    root, ext = os.path.splitext(path)  # keep the extension: save_model picks the format from it
+    tmp = f"{root}.{os.getpid()}.tmp{ext}"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def export(model_pkl=MODEL_PKL, scaler_pkl=SCALER_PKL, encoder_pkl=ENCODER_PKL,
+           model_path=MODEL_PATH, meta_path=META_PATH):
+    import joblib
+
+    model = joblib.load(model_pkl)
+    scaler = joblib.load(scaler_pkl)
+    le = joblib.load(encoder_pkl)
+
+    booster = model.get_booster()
+    scale, offset, clip = fold_scaler(scaler)
+    names = getattr(scaler, 'feature_names_in_', None)
+    # The sklearn wrapper predicts with the best iteration when early stopping was used
+    best = getattr(model, 'best_iteration', None)
+    meta = {
+        "features": None if names is None else [str(n) for n in names],
+        "scale": scale.tolist(),
+        "offset": offset.tolist(),
+        "clip": clip,
+        "used": split_features(booster, len(scale)),
+        "labels": [str(c) for c in le.classes_],
+        "iteration_range": [0, int(best) + 1] if best is not None else None,
+    }
+
+    def write_meta(path):
+        with open(path, 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    _replace(model_path, booster.save_model)
+    _replace(meta_path, write_meta)
+    return meta
+
+
+if __name__ == "__main__":
+    meta = export()
+    print(f"✅ Exported {MODEL_PATH} and {META_PATH} ({len(meta['scale'])} features, "
+          f"{len(meta['used'])} used by the trees, {len(meta['labels'])} classes)")
+    unused = sorted(set(range(len(meta['scale']))) - set(meta['used']))
+    if unused:
+        names = meta['features'] or [f'f{i}' for i in range(len(meta['scale']))]
+        print(f"   Never split on (not computed at inference): {', '.join(names[i] for i in unused)}")
@@ -0,0 +1,391 @@
+"""
+Per-flow statistics, updated packet by packet.
+
+Instead of keeping every scapy packet of a conversation around until the
+analysis thread gets to it, each flow owns one FlowStats object that folds
+packets in as they arrive (O(1) per packet) and can read out the 78
+CICIDS2017 features at any time (O(1) per flow). Memory is bounded by the
+number of flows, not the number of packets.
+
+Semantics follow CICFlowMeter, the tool that produced the training data:
+lengths are payload bytes, times are microseconds, standard deviations are
+sample (n-1) statistics.
+"""
+import linecache
+
+# Columns must match training data EXACTLY (CICIDS2017 order)
+COLUMNS = [
+    'Destination Port', 'Flow Duration', 'Total Fwd Packets',
+    'Total Backward Packets', 'Total Length of Fwd Packets',
+    'Total Length of Bwd Packets', 'Fwd Packet Length Max',
+    'Fwd Packet Length Min', 'Fwd Packet Length Mean',
+    'Fwd Packet Length Std', 'Bwd Packet Length Max',
+    'Bwd Packet Length Min', 'Bwd Packet Length Mean',
+    'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s',
+    'Flow IAT Mean', 'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min',
+    'Fwd IAT Total', 'Fwd IAT Mean', 'Fwd IAT Std', 'Fwd IAT Max',
+    'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std',
+    'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
+    'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length',
+    'Bwd Header Length', 'Fwd Packets/s', 'Bwd Packets/s',
+    'Min Packet Length', 'Max Packet Length', 'Packet Length Mean',
+    'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count',
+    'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count',
+    'ACK Flag Count', 'URG Flag Count', 'CWE Flag Count',
+    'ECE Flag Count', 'Down/Up Ratio', 'Average Packet Size',
+    'Avg Fwd Segment Size', 'Avg Bwd Segment Size',
+    'Fwd Header Length.1', 'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk',
+    'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk',
+    'Bwd Avg Bulk Rate', 'Subflow Fwd Packets', 'Subflow Fwd Bytes',
+    'Subflow Bwd Packets', 'Subflow Bwd Bytes', 'Init_Win_bytes_forward',
+    'Init_Win_bytes_backward', 'act_data_pkt_fwd', 'min_seg_size_forward',
+    'Active Mean', 'Active Std', 'Active Max', 'Active Min',
+    'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
+]
+
+# TCP flag bits (as in the TCP header / int(scapy_packet[TCP].flags))
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+URG = 0x20
+ECE = 0x40
+CWR = 0x80
+
+# CICFlowMeter constants (microseconds)
+ACTIVITY_TIMEOUT = 5000000
+SUBFLOW_TIMEOUT = 1000000
+BULK_TIMEOUT = 1000000
+BULK_MIN_PACKETS = 4
+
+
+class RunningStats:
+    """Count / sum / min / max / mean / variance in O(1) memory (Welford)."""
+
+    __slots__ = ('n', 'total', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def add(self, x):
+        n = self.n + 1
+        self.n = n
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (x - self.mean)
+        if n == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def std(self):
+        return self.variance() ** 0.5
+
+
+class BulkStats:
+    """CICFlowMeter bulk-transfer detector for one direction of a flow."""
+
+    __slots__ = ('start_helper', 'count_helper', 'size_helper', 'last_ts',
+                 'state_count', 'packet_count', 'size_total', 'duration')
+
+    def __init__(self):
+        self.start_helper = 0
+        self.count_helper = 0
+        self.size_helper = 0
+        self.last_ts = 0
+        self.state_count = 0
+        self.packet_count = 0
+        self.size_total = 0
+        self.duration = 0
+
+    def add(self, ts, size, other_last_ts):
+        if other_last_ts > self.start_helper:
+            self.start_helper = 0
+        if size <= 0:
+            return
+        if self.start_helper == 0 or ts - self.last_ts > BULK_TIMEOUT:
+            self.start_helper = ts
+            self.count_helper = 1
+            self.size_helper = size
+        else:
+            self.count_helper += 1
+            self.size_helper += size
+            if self.count_helper == BULK_MIN_PACKETS:
+                self.state_count += 1
+                self.packet_count += self.count_helper
+                self.size_total += self.size_helper
+                self.duration += ts - self.start_helper
+            elif self.count_helper > BULK_MIN_PACKETS:
+                self.packet_count += 1
+                self.size_total += size
+                self.duration += ts - self.last_ts
+        self.last_ts = ts
+
+    def avg_bytes(self):
+        return self.size_total / self.state_count if self.state_count else 0
+
+    def avg_packets(self):
+        return self.packet_count / self.state_count if self.state_count else 0
+
+    def rate(self):
+        return self.size_total / (self.duration / 1e6) if self.duration else 0
+
+
+class FlowStats:
+    """
+    Running state of one flow. Call update() for every packet, then
+    features() to get one row of COLUMNS.
+    """
+
+    __slots__ = (
+        'dst_port', 'first_ts', 'last_ts', 'fwd_last_ts', 'bwd_last_ts',
+        'fwd_len', 'bwd_len', 'all_len', 'flow_iat', 'fwd_iat', 'bwd_iat',
+        'fwd_bulk', 'bwd_bulk', 'active', 'idle',
+        'start_active', 'end_active', 'sf_last_ts', 'sf_count',
+        'fwd_hdr', 'bwd_hdr', 'fwd_psh', 'bwd_psh', 'fwd_urg', 'bwd_urg',
+        'fin', 'syn', 'rst', 'psh', 'ack', 'urg', 'cwr', 'ece',
+        'init_win_fwd', 'init_win_bwd', 'act_data_fwd', 'min_seg_fwd',
+    )
+
+    def __init__(self, dst_port):
+        self.dst_port = dst_port
+        self.first_ts = self.last_ts = 0
+        self.fwd_last_ts = self.bwd_last_ts = 0
+        self.fwd_len = RunningStats()
+        self.bwd_len = RunningStats()
+        self.all_len = RunningStats()
+        self.flow_iat = RunningStats()
+        self.fwd_iat = RunningStats()
+        self.bwd_iat = RunningStats()
+        self.fwd_bulk = BulkStats()
+        self.bwd_bulk = BulkStats()
+        self.active = RunningStats()
+        self.idle = RunningStats()
+        self.start_active = self.end_active = 0
+        self.sf_last_ts = 0
+        self.sf_count = 1
+        self.fwd_hdr = self.bwd_hdr = 0
+        self.fwd_psh = self.bwd_psh = self.fwd_urg = self.bwd_urg = 0
+        self.fin = self.syn = self.rst = self.psh = 0
+        self.ack = self.urg = self.cwr = self.ece = 0
+        self.init_win_fwd = self.init_win_bwd = -1
+        self.act_data_fwd = 0
+        self.min_seg_fwd = 0
+
+    @property
+    def packet_count(self):
+        return self.all_len.n
+
+    def update(self, ts, is_fwd, payload_len, header_len, flags=0, window=-1):
+        """
+        Fold one packet into the flow.
+        ts is in seconds (packet.time), window is -1 for non-TCP packets.
+        """
+        ts = int(ts * 1000000)
+
+        if self.all_len.n == 0:
+            self.first_ts = self.start_active = self.end_active = ts
+            self.sf_last_ts = ts
+        else:
+            self.flow_iat.add(ts - self.last_ts)
+            # Subflows: a gap longer than SUBFLOW_TIMEOUT starts a new one
+            if ts - self.sf_last_ts > SUBFLOW_TIMEOUT:
+                self.sf_count += 1
+            self.sf_last_ts = ts
+            # Active/Idle periods
+            if ts - self.end_active > ACTIVITY_TIMEOUT:
+                if self.end_active - self.start_active > 0:
+                    self.active.add(self.end_active - self.start_active)
+                self.idle.add(ts - self.end_active)
+                self.start_active = self.end_active = ts
+            else:
+                self.end_active = ts
+        self.last_ts = ts
+        self.all_len.add(payload_len)
+
+        if is_fwd:
+            if self.fwd_len.n:
+                self.fwd_iat.add(ts - self.fwd_last_ts)
+            else:
+                self.init_win_fwd = window
+                self.min_seg_fwd = header_len
+            self.fwd_last_ts = ts
+            self.fwd_len.add(payload_len)
+            self.fwd_hdr += header_len
+            if header_len < self.min_seg_fwd:
+                self.min_seg_fwd = header_len
+            if payload_len > 0:
+                self.act_data_fwd += 1
+            self.fwd_bulk.add(ts, payload_len, self.bwd_bulk.last_ts)
+            if flags & PSH:
+                self.fwd_psh += 1
+            if flags & URG:
+                self.fwd_urg += 1
+        else:
+            if self.bwd_len.n:
+                self.bwd_iat.add(ts - self.bwd_last_ts)
+            else:
+                self.init_win_bwd = window
+            self.bwd_last_ts = ts
+            self.bwd_len.add(payload_len)
+            self.bwd_hdr += header_len
+            self.bwd_bulk.add(ts, payload_len, self.fwd_bulk.last_ts)
+            if flags & PSH:
+                self.bwd_psh += 1
+            if flags & URG:
+                self.bwd_urg += 1
+
+        if flags:
+            if flags & FIN:
+                self.fin += 1
+            if flags & SYN:
+                self.syn += 1
+            if flags & RST:
+                self.rst += 1
+            if flags & PSH:
+                self.psh += 1
+            if flags & ACK:
+                self.ack += 1
+            if flags & URG:
+                self.urg += 1
+            if flags & CWR:
+                self.cwr += 1
+            if flags & ECE:
+                self.ece += 1
+
+    def features(self):
+        """Returns the current feature row as a list ordered like COLUMNS."""
+        return _read_all(self)
+
+
+# How each column is read out of a FlowStats `f`, as a Python expression over
+# the locals set up by _READER_PRELUDE. feature_reader() compiles the ones
+# a model needs into a single function.
+_READER_PRELUDE = """
+    fwd, bwd, pkt = f.fwd_len, f.bwd_len, f.all_len
+    duration = f.last_ts - f.first_ts
+    seconds = duration / 1e6
+    sf = f.sf_count
+"""
+FEATURE_EXPRESSIONS = {
+    'Destination Port': 'f.dst_port',
+    'Flow Duration': 'duration',
+    'Total Fwd Packets': 'fwd.n',
+    'Total Backward Packets': 'bwd.n',
+    'Total Length of Fwd Packets': 'fwd.total',
+    'Total Length of Bwd Packets': 'bwd.total',
+    'Fwd Packet Length Max': 'fwd.max',
+    'Fwd Packet Length Min': 'fwd.min',
+    'Fwd Packet Length Mean': 'fwd.mean',
+    'Fwd Packet Length Std': 'fwd.std()',
+    'Bwd Packet Length Max': 'bwd.max',
+    'Bwd Packet Length Min': 'bwd.min',
+    'Bwd Packet Length Mean': 'bwd.mean',
+    'Bwd Packet Length Std': 'bwd.std()',
+    'Flow Bytes/s': '(fwd.total + bwd.total) / seconds if seconds > 0 else 0',
+    'Flow Packets/s': 'pkt.n / seconds if seconds > 0 else 0',
+    'Flow IAT Mean': 'f.flow_iat.mean',
+    'Flow IAT Std': 'f.flow_iat.std()',
+    'Flow IAT Max': 'f.flow_iat.max',
+    'Flow IAT Min': 'f.flow_iat.min',
+    'Fwd IAT Total': 'f.fwd_iat.total',
+    'Fwd IAT Mean': 'f.fwd_iat.mean',
+    'Fwd IAT Std': 'f.fwd_iat.std()',
+    'Fwd IAT Max': 'f.fwd_iat.max',
+    'Fwd IAT Min': 'f.fwd_iat.min',
+    'Bwd IAT Total': 'f.bwd_iat.total',
+    'Bwd IAT Mean': 'f.bwd_iat.mean',
+    'Bwd IAT Std': 'f.bwd_iat.std()',
+    'Bwd IAT Max': 'f.bwd_iat.max',
+    'Bwd IAT Min': 'f.bwd_iat.min',
+    'Fwd PSH Flags': 'f.fwd_psh',
+    'Bwd PSH Flags': 'f.bwd_psh',
+    'Fwd URG Flags': 'f.fwd_urg',
+    'Bwd URG Flags': 'f.bwd_urg',
+    'Fwd Header Length': 'f.fwd_hdr',
+    'Bwd Header Length': 'f.bwd_hdr',
+    'Fwd Packets/s': 'fwd.n / seconds if seconds > 0 else 0',
+    'Bwd Packets/s': 'bwd.n / seconds if seconds > 0 else 0',
+    'Min Packet Length': 'pkt.min',
+    'Max Packet Length': 'pkt.max',
+    'Packet Length Mean': 'pkt.mean',
+    'Packet Length Std': 'pkt.std()',
+    'Packet Length Variance': 'pkt.variance()',
+    'FIN Flag Count': 'f.fin',
+    'SYN Flag Count': 'f.syn',
+    'RST Flag Count': 'f.rst',
+    'PSH Flag Count': 'f.psh',
+    'ACK Flag Count': 'f.ack',
+    'URG Flag Count': 'f.urg',
+    'CWE Flag Count': 'f.cwr',
+    'ECE Flag Count': 'f.ece',
+    'Down/Up Ratio': 'bwd.n // fwd.n if fwd.n else 0',
+    'Average Packet Size': 'pkt.total / pkt.n if pkt.n else 0',
+    'Avg Fwd Segment Size': 'fwd.mean',
+    'Avg Bwd Segment Size': 'bwd.mean',
+    'Fwd Header Length.1': 'f.fwd_hdr',
+    'Fwd Avg Bytes/Bulk': 'f.fwd_bulk.avg_bytes()',
+    'Fwd Avg Packets/Bulk': 'f.fwd_bulk.avg_packets()',
+    'Fwd Avg Bulk Rate': 'f.fwd_bulk.rate()',
+    'Bwd Avg Bytes/Bulk': 'f.bwd_bulk.avg_bytes()',
+    'Bwd Avg Packets/Bulk': 'f.bwd_bulk.avg_packets()',
+    'Bwd Avg Bulk Rate': 'f.bwd_bulk.rate()',
+    'Subflow Fwd Packets': 'fwd.n / sf',
+    'Subflow Fwd Bytes': 'fwd.total / sf',
+    'Subflow Bwd Packets': 'bwd.n / sf',
+    'Subflow Bwd Bytes': 'bwd.total / sf',
+    'Init_Win_bytes_forward': 'f.init_win_fwd',
+    'Init_Win_bytes_backward': 'f.init_win_bwd',
+    'act_data_pkt_fwd': 'f.act_data_fwd',
+    'min_seg_size_forward': 'f.min_seg_fwd',
+    'Active Mean': 'f.active.mean',
+    'Active Std': 'f.active.std()',
+    'Active Max': 'f.active.max',
+    'Active Min': 'f.active.min',
+    'Idle Mean': 'f.idle.mean',
+    'Idle Std': 'f.idle.std()',
+    'Idle Max': 'f.idle.max',
+    'Idle Min': 'f.idle.min',
+}
+
+
+def feature_reader(columns):
+    """
+    Compiles a function flow -> [value of each of `columns`] that computes
+    only those columns (a None column reads as 0 without computing
+    anything). The inference path uses it to read exactly the model's
+    inputs, in the model's order, instead of all of COLUMNS.
+
+    Generated rather than assembled from per-column closures: the
+    expressions share the prelude's locals and run in a single frame. On
+    20000 random flows, closures (operator.attrgetter for plain attributes,
+    small functions for the rest) read 60k flows/s for all of COLUMNS
+    against 172k compiled (108k vs 205k for a model's 50 inputs). The
+    source is registered with linecache, so tracebacks show the line that
+    failed, one column per line.
+    """
+    lines = ["def read(f):", *_READER_PRELUDE.strip('\n').splitlines(), "    return ["]
+    lines += [f"        0,  # {i}" if c is None else f"        ({FEATURE_EXPRESSIONS[c]}),  # {c}"
+              for i, c in enumerate(columns)]
+    lines.append("    ]")
+    source = "\n".join(lines) + "\n"
+    filename = f"<feature_reader {len(columns)} columns {id(lines):x}>"
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace['read']
+
+
+_read_all = feature_reader(COLUMNS)
@@ -0,0 +1,306 @@
+"""
+Bidirectional flow table with CICFlowMeter-style flow lifecycle.
+
+Both directions of a conversation share one flow. The key is a single int
+packing the two (ip, port) endpoints in canonical (sorted) order plus the
+IP protocol number, which is cheaper to hash and smaller than a tuple of
+strings. The forward direction is whoever sent the first packet.
+
+A flow ends when
+  - no packet has been seen for idle_timeout seconds,
+  - it has been running for active_timeout seconds (long connections are
+    cut into active_timeout-sized flows, as CICFlowMeter does), or
+  - TCP closes it: a RST, or a FIN seen in both directions.
+
+Deadlines live in a min-heap, so expire() only looks at flows that are due
+instead of scanning the whole table. Packets do not touch the heap: a
+popped entry whose flow has seen traffic since is pushed back with its new
+deadline, which costs one heap operation per flow per idle_timeout.
+
+Memory is bounded by max_flows (about 2 KB per flow): flows ended by
+FIN/RST and waiting for the next sweep count too. When a new flow finds
+the table full, EVICT_FRACTION of max_flows is evicted at once:
+  - oldest:   the flows idle the longest, dropped unscored
+  - smallest: the flows with the fewest packets, dropped unscored
+  - score:    the flows idle the longest, handed to on_evict (the owner's
+              scoring function) right away and then dropped
+and the table enters degraded mode until a sweep finds it below
+RECOVER_FRACTION of max_flows. In degraded mode new conversations are
+  - sample:    tracked for one in sample_rate of them (by key, so both
+               directions agree), the others ignored
+  - aggregate: folded into one flow per source (and protocol), shown as
+               going to 0.0.0.0:0; FIN/RST never closes it
+  - off:       tracked as usual, evicting as needed.
+The evicted / sampled_out / aggregated counters and the metrics below tell
+when the sensor is overloaded.
+"""
+import heapq
+import itertools
+import socket
+import struct
+import metrics
+from flow_features import FlowStats, FIN, RST
+
+IDLE_TIMEOUT = 60.0
+ACTIVE_TIMEOUT = 120.0
+MAX_FLOWS = 500000       # flows held at once (0 = unbounded)
+EVICTION = 'oldest'
+DEGRADED = 'sample'
+SAMPLE_RATE = 10         # degraded 'sample': one new conversation in SAMPLE_RATE is tracked
+EVICT_FRACTION = 0.01    # share of max_flows evicted at once when the table is full
+RECOVER_FRACTION = 0.9   # degraded mode ends at a sweep below this share of max_flows
+
+EVICTIONS = ('oldest', 'smallest', 'score')
+DEGRADED_MODES = ('sample', 'aggregate', 'off')
+
+PROTO_NAMES = {6: "TCP", 17: "UDP"}
+
+_FIN_FWD = 1
+_FIN_BWD = 2
+
+ACTIVE_FLOWS = metrics.gauge('phoenix_flows_active', "Flows in the flow table (at the last sweep)")
+FLOWS_ENDED = metrics.counter('phoenix_flows_ended_total', "Flows handed to detection, by how they ended",
+                              label='reason')
+FLOW_OVERLOAD = metrics.counter('phoenix_flow_overload_total',
+                                "Full flow table: flows evicted, conversations not tracked (sampled_out), "
+                                "packets folded into per-source flows (aggregated)", label='action')
+FLOW_TABLE_DEGRADED = metrics.gauge('phoenix_flow_table_degraded', "1 while the flow table is in degraded mode")
+
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(n):
+    return socket.inet_ntoa(struct.pack('!I', n))
+
+
+def pack_key(src_ip, dst_ip, src_port, dst_port, proto):
+    """
+    Returns (key, swapped): key is the same for both directions of a
+    conversation, swapped tells whether (src, dst) was reversed to build it.
+    """
+    a = src_ip << 16 | src_port
+    b = dst_ip << 16 | dst_port
+    if a <= b:
+        return (a << 48 | b) << 8 | proto, False
+    return (b << 48 | a) << 8 | proto, True
+
+
+def flow_hash(src_ip, dst_ip, src_port, dst_port, proto):
+    """
+    32-bit hash that is the same for both directions of a conversation.
+    Its high bits are the well-mixed ones: map it to a worker with shard().
+    """
+    h = (src_ip ^ dst_ip) ^ ((src_port ^ dst_port) << 8) ^ proto
+    return (h * 0x9E3779B1) & 0xFFFFFFFF
+
+
+def shard(h, n):
+    """Index in range(n) for a flow_hash, taken from its high bits."""
+    return h * n >> 32
+
+
+def unpack_key(key):
+    """Inverse of pack_key (canonical order): (ip_a, ip_b, port_a, port_b, proto) as ints."""
+    proto = key & 0xFF
+    b = key >> 8 & 0xFFFFFFFFFFFF
+    a = key >> 56
+    return a >> 16, b >> 16, a & 0xFFFF, b & 0xFFFF, proto
+
+
+class _Flow(FlowStats):
+    """FlowStats plus the bookkeeping the table needs."""
+
+    __slots__ = ('seq', 'fin_dirs', 'swapped')
+
+    def __init__(self, dst_port, seq, swapped):
+        super().__init__(dst_port)
+        self.seq = seq
+        self.fin_dirs = 0
+        self.swapped = swapped  # orientation of the first packet relative to the key
+
+
+def forward_key(key, flow):
+    """unpack_key in the flow's forward direction: (src_ip, dst_ip, src_port, dst_port, proto) as ints."""
+    ip_a, ip_b, port_a, port_b, proto = unpack_key(key)
+    if flow.swapped:
+        return ip_b, ip_a, port_b, port_a, proto
+    return ip_a, ip_b, port_a, port_b, proto
+
+
+def endpoints(key, flow):
+    """(src_ip, dst_ip, src_port, dst_port, proto) of a flow, in its forward direction."""
+    src_ip, dst_ip, src_port, dst_port, proto = forward_key(key, flow)
+    return int_to_ip(src_ip), int_to_ip(dst_ip), src_port, dst_port, PROTO_NAMES.get(proto, proto)
+
+
+class FlowTable:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT, max_flows=MAX_FLOWS,
+                 eviction=EVICTION, degraded=DEGRADED, sample_rate=SAMPLE_RATE, on_evict=None):
+        if eviction not in EVICTIONS:
+            raise ValueError(f"unknown eviction {eviction!r} (one of {', '.join(EVICTIONS)})")
+        if degraded not in DEGRADED_MODES:
+            raise ValueError(f"unknown degraded mode {degraded!r} (one of {', '.join(DEGRADED_MODES)})")
+        if eviction == 'score' and on_evict is None:
+            raise ValueError("eviction 'score' needs an on_evict function")
+        if max_flows < 0 or sample_rate < 1:
+            raise ValueError("max_flows must be >= 0 and sample_rate >= 1")
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.eviction = eviction
+        self.degraded = degraded
+        self.sample_rate = sample_rate
+        self.on_evict = on_evict  # on_evict([(key, flow)]) scores flows evicted by 'score'
+        self.flows = {}
+        self._heap = []  # (deadline, flow.seq, key)
+        self._seq = itertools.count()
+        self._closed = []  # (key, flow) ended by FIN/RST, handed out by expire()
+        self.overloaded = False  # degraded mode
+        self.evicted = 0      # flows evicted from a full table
+        self.sampled_out = 0  # packets of conversations not tracked in degraded mode
+        self.aggregated = 0   # packets folded into per-source flows in degraded mode
+
+    def __len__(self):
+        return len(self.flows)
+
+    def _deadline(self, flow):
+        return min(flow.last_ts / 1e6 + self.idle_timeout,
+                   flow.first_ts / 1e6 + self.active_timeout)
+
+    def add(self, src_ip, dst_ip, src_port, dst_port, proto, ts,
+            payload_len, header_len, flags=0, window=-1):
+        """
+        Folds one packet into its flow.
+        IPs are ints (see ip_to_int), proto is the IP protocol number, ts is in seconds.
+        """
+        key, swapped = pack_key(src_ip, dst_ip, src_port, dst_port, proto)
+        flow = self.flows.get(key)
+        if flow is None and self.max_flows and (
+                self.overloaded or len(self.flows) + len(self._closed) >= self.max_flows):
+            self._set_overloaded(True)
+            if self.degraded == 'sample':
+                if (key * 0x9E3779B1 >> 24) % self.sample_rate:
+                    self.sampled_out += 1
+                    FLOW_OVERLOAD.inc(1, 'sampled_out')
+                    return
+            elif self.degraded == 'aggregate':
+                key, swapped = pack_key(src_ip, 0, 0, 0, proto)
+                dst_port = 0
+                flow = self.flows.get(key)
+                self.aggregated += 1
+                FLOW_OVERLOAD.inc(1, 'aggregated')
+        if flow is not None and ts - flow.first_ts / 1e6 >= self.active_timeout:
+            # Active timeout reached: close it and start a fresh flow
+            del self.flows[key]
+            self._closed.append((key, flow))
+            FLOWS_ENDED.inc(1, 'active_timeout')
+            flow = None
+        if flow is None:
+            if self.max_flows:
+                if len(self.flows) + len(self._closed) >= self.max_flows:
+                    self._evict()
+                if len(self._heap) >= 2 * self.max_flows:
+                    self._compact()
+            flow = self.flows[key] = _Flow(dst_port, next(self._seq), swapped)
+            is_fwd = True
+            flow.update(ts, is_fwd, payload_len, header_len, flags, window)
+            heapq.heappush(self._heap, (self._deadline(flow), flow.seq, key))
+        else:
+            is_fwd = swapped == flow.swapped
+            flow.update(ts, is_fwd, payload_len, header_len, flags, window)
+
+        if flags & (FIN | RST) and key >> 56:  # lower endpoint 0.0.0.0:0: a per-source aggregate
+            if flags & FIN:
+                flow.fin_dirs |= _FIN_FWD if is_fwd else _FIN_BWD
+            if flags & RST or flow.fin_dirs == _FIN_FWD | _FIN_BWD:
+                del self.flows[key]
+                self._closed.append((key, flow))
+                FLOWS_ENDED.inc(1, 'fin_rst')
+
+    def _set_overloaded(self, overloaded):
+        if overloaded != self.overloaded:
+            self.overloaded = overloaded
+            FLOW_TABLE_DEGRADED.set(int(overloaded))
+
+    def _evict(self):
+        """Makes room in a full table: removes EVICT_FRACTION of max_flows as the eviction policy says."""
+        n = max(1, int(self.max_flows * EVICT_FRACTION))
+        flows = self.flows
+        if self.eviction == 'smallest':
+            keys = heapq.nsmallest(n, flows, key=lambda k: flows[k].all_len.n)
+        else:
+            # Least recently active first: heap entries are lower bounds of the flows'
+            # deadlines, so refresh stale ones until the top is exact
+            keys, heap = [], self._heap
+            while heap and len(keys) < n:
+                stale, seq, key = heapq.heappop(heap)
+                flow = flows.get(key)
+                if flow is None or flow.seq != seq:
+                    continue
+                deadline = self._deadline(flow)
+                if deadline > stale:
+                    heapq.heappush(heap, (deadline, seq, key))
+                else:
+                    keys.append(key)
+        evicted = [(key, flows.pop(key)) for key in keys]
+        if len(evicted) < n and self._closed:
+            # Mostly flows that already ended (e.g. a RST flood): take the oldest of those
+            k = n - len(evicted)
+            evicted += self._closed[:k]
+            del self._closed[:k]
+        self.evicted += len(evicted)
+        FLOW_OVERLOAD.inc(len(evicted), 'evicted')
+        if self.eviction == 'score':
+            FLOWS_ENDED.inc(len(keys), 'evicted')
+            self.on_evict(evicted)
+
+    def _compact(self):
+        """Rebuilds the heap from the live flows (evictions and FIN/RST leave stale entries behind)."""
+        self._heap = [(self._deadline(flow), flow.seq, key) for key, flow in self.flows.items()]
+        heapq.heapify(self._heap)
+
+    def expire(self, now):
+        """
+        Removes and returns [(key, flow)] for every flow that ended by
+        FIN/RST or whose idle/active deadline is <= now (seconds).
+        """
+        done, self._closed = self._closed, []
+        closed = len(done)
+        heap, flows = self._heap, self.flows
+        while heap and heap[0][0] <= now:
+            _, seq, key = heapq.heappop(heap)
+            flow = flows.get(key)
+            if flow is None or flow.seq != seq:
+                continue  # already closed (and maybe replaced by a newer flow)
+            deadline = self._deadline(flow)
+            if deadline > now:
+                heapq.heappush(heap, (deadline, seq, key))
+            else:
+                del flows[key]
+                done.append((key, flow))
+        if len(done) > closed:
+            FLOWS_ENDED.inc(len(done) - closed, 'timeout')
+        if self.overloaded and len(flows) < RECOVER_FRACTION * self.max_flows:
+            self._set_overloaded(False)
+        ACTIVE_FLOWS.set(len(flows))
+        return done
+
+    def flush(self):
+        """Removes and returns every flow, e.g. at shutdown or end of a capture file."""
+        done = self._closed + list(self.flows.items())
+        FLOWS_ENDED.inc(len(self.flows), 'flush')
+        ACTIVE_FLOWS.set(0)
+        self._set_overloaded(False)
+        self._closed = []
+        self.flows = {}
+        self._heap = []
+        return done
+
+    def overload_summary(self):
+        """'n evicted, ...' for the log (empty when the table never filled up)."""
+        parts = [f"{n} {what}" for what, n in (("flows evicted", self.evicted),
+                                               ("packets not tracked", self.sampled_out),
+                                               ("packets aggregated per source", self.aggregated)) if n]
+        return ", ".join(parts)
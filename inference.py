@@ -0,0 +1,265 @@
+"""
+Batched inference for a window of flows.
+
+The model is loaded as a native XGBoost Booster (xgboost_final.ubj) and
+the scaler as two vectors (model_meta.json), both produced from the
+training pickles by export_model.py, which runs by itself the first time
+(that one-off export needs joblib and scikit-learn). No pickle, pandas or
+scikit-learn object is involved per call: a whole window of flows is one
+feature matrix, one multiply-add for
+the scaler and one Booster.inplace_predict on the raw array; labels and
+confidences are read out of that single result with a precomputed
+class-index -> label lookup.
+
+The feature matrix only holds the model's inputs, in the model's order,
+read by a reader compiled for them (flow_features.feature_reader): of the
+78 COLUMNS, the ones the scaler drops are never computed, and neither are
+the inputs no tree splits on. Those get a zero scale, so the multiply-add
+turns them into a constant the trees ignore.
+
+Scans and floods produce thousands of flows with the same inputs.
+predict() first looks each row up in a PredictionCache keyed on the input
+vector; only rows it has not seen go to the model, once per distinct
+vector. Keys are exact by default, so a cached verdict is the model's;
+cache_bits < 52 opts in to sharing entries between nearly equal vectors
+(identifiers and counts, EXACT_COLUMNS, are never rounded).
+
+An optional rules.RuleStage runs in detect() before all of this and
+classifies allowlisted traffic and obvious floods/scans without the model.
+
+XGBoost is imported by Detector() only: sensors that send their feature
+matrices to a shared model server (model_server.RemoteDetector) do not
+need it.
+"""
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import metrics
+from flow_features import COLUMNS, feature_reader
+from flow_table import endpoints
+from export_model import MODEL_PATH, META_PATH
+
+BENIGN_LABELS = ("BENIGN", "Normal Traffic")
+BATCH_SIZE = 65536  # flows per model call
+MIN_PACKETS = 2     # shorter flows are noise and are not scored
+CACHE_SIZE = 100000  # cached input vectors (0 disables the cache)
+CACHE_BITS = 52      # mantissa bits kept per input: 52 is exact; 6 lets values within ~1.5% share an entry
+
+# Identifiers and counts: a rounded port or packet count is a different flow, so never quantized
+EXACT_COLUMNS = frozenset((
+    'Destination Port', 'Total Fwd Packets', 'Total Backward Packets',
+    'Fwd PSH Flags', 'Bwd PSH Flags', 'Fwd URG Flags', 'Bwd URG Flags',
+    'FIN Flag Count', 'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count',
+    'ACK Flag Count', 'URG Flag Count', 'CWE Flag Count', 'ECE Flag Count',
+    'Subflow Fwd Packets', 'Subflow Bwd Packets', 'Init_Win_bytes_forward',
+    'Init_Win_bytes_backward', 'act_data_pkt_fwd', 'min_seg_size_forward'))
+
+FEATURE_SECONDS = metrics.histogram('phoenix_feature_seconds', "Feature extraction time per batch")
+INFERENCE_SECONDS = metrics.histogram('phoenix_inference_seconds',
+                                      "Model time per batch, prediction cache included")
+BATCH_FLOWS = metrics.histogram('phoenix_batch_flows', "Flows per model batch", metrics.SIZE_BUCKETS)
+CACHE_LOOKUPS = metrics.counter('phoenix_prediction_cache_total',
+                                "Prediction cache lookups (miss: distinct vectors scored by the model)",
+                                label='result')
+DETECTIONS = metrics.counter('phoenix_detections_total', "Attacks detected", label='attack_type')
+INFERENCE_ERRORS = metrics.counter('phoenix_inference_errors_total', "Batches lost to an inference error")
+
+
+def ensure_exported(model_path=MODEL_PATH, meta_path=META_PATH):
+    """Converts the training pickles to the native files if they are missing (one-off)."""
+    if not (os.path.exists(model_path) and os.path.exists(meta_path)):
+        print("🔧 Exporting the pickled model to XGBoost's native format (one-off)...")
+        import export_model
+        export_model.export(model_path=model_path, meta_path=meta_path)
+
+
+def feature_matrix(flows):
+    """Stacks the feature rows of FlowStats objects into one (n, len(COLUMNS)) matrix."""
+    return np.array([flow.features() for flow in flows], dtype=np.float64)
+
+
+class PredictionCache:
+    """
+    LRU of model inputs -> (class index, confidence).
+
+    Rows are keyed on their float64 inputs with all but the top `bits`
+    mantissa bits cleared, so values that differ by less than about
+    2**-bits (relative) share an entry; bits=52 (the default) only matches
+    exact duplicates. Columns flagged in `exact` (a boolean per input) keep
+    every bit whatever `bits` is. Raises ValueError on a negative size.
+    """
+
+    def __init__(self, size=CACHE_SIZE, bits=CACHE_BITS, exact=None):
+        if size < 0:
+            raise ValueError(f"cache size must be >= 0 (0 disables the cache), got {size}")
+        self.size = size
+        self.bits = bits
+        self._mask = np.int64(~((1 << (52 - bits)) - 1))  # sign, exponent and top mantissa bits
+        if exact is not None and bits < 52:
+            self._mask = np.where(np.asarray(exact, dtype=bool), np.int64(-1), self._mask)
+        self._entries = OrderedDict()  # key -> (class_idx, confidence), least recently used first
+        self.hits = 0    # rows answered from the cache
+        self.misses = 0  # distinct vectors sent to the model
+
+    def keys(self, X):
+        """One hashable key per row of X."""
+        Q = np.ascontiguousarray(X, dtype=np.float64).view(np.int64) & self._mask
+        return [row.tobytes() for row in Q]
+
+    def lookup(self, keys, class_idx, confidence):
+        """
+        Fills the rows that are cached into class_idx / confidence.
+        Returns {key: [rows]} for the vectors the model still has to score.
+        """
+        entries, missing = self._entries, {}
+        for i, key in enumerate(keys):
+            hit = entries.get(key)
+            if hit is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                entries.move_to_end(key)
+                class_idx[i], confidence[i] = hit
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        CACHE_LOOKUPS.inc(len(keys) - len(missing), 'hit')
+        CACHE_LOOKUPS.inc(len(missing), 'miss')
+        return missing
+
+    def store(self, keys, class_idx, confidence):
+        entries = self._entries
+        for key, c, p in zip(keys, class_idx.tolist(), confidence.tolist()):
+            entries[key] = (c, p)
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Detector:
+    def __init__(self, model_path=MODEL_PATH, meta_path=META_PATH,
+                 cache_size=CACHE_SIZE, cache_bits=CACHE_BITS, rules=None):
+        import xgboost as xgb
+        ensure_exported(model_path, meta_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.booster = xgb.Booster(model_file=model_path)
+        self.iteration_range = tuple(meta["iteration_range"] or (0, 0))
+
+        # Scaler folded into X * scale + offset (see export_model.fold_scaler)
+        self.scale = np.asarray(meta["scale"], dtype=np.float64)
+        self.offset = np.asarray(meta["offset"], dtype=np.float64)
+        self.clip = meta["clip"]
+
+        # The model was trained on a subset of COLUMNS; no tree splits on some of them
+        used = np.zeros(len(self.scale), dtype=bool)
+        used[meta.get("used", slice(None))] = True
+        self._setup(meta["labels"], meta["features"] or COLUMNS[:len(self.scale)], used,
+                    cache_size, cache_bits, rules)
+        self.scale[~self.used] = 0.0  # unused inputs: not computed, scaled to a constant
+
+    def _setup(self, labels, features, used, cache_size, cache_bits, rules):
+        """Everything but the model itself (shared with model_server.RemoteDetector)."""
+        # Class index -> label, and which classes raise an alert
+        self.labels = np.asarray(labels, dtype=object)
+        self.is_attack = ~np.isin(self.labels, BENIGN_LABELS)
+
+        # The model's inputs, in order; only the used ones are computed
+        self.features = list(features)
+        self.feature_index = np.array([COLUMNS.index(n) for n in self.features])
+        self.used = np.asarray(used, dtype=bool)
+        self._read = feature_reader([n if u else None for n, u in zip(self.features, self.used)])
+
+        key_columns = [n for n, u in zip(self.features, self.used) if u]  # predict() keys on these
+        self.cache = PredictionCache(cache_size, cache_bits,
+                                     [n in EXACT_COLUMNS for n in key_columns]) if cache_size != 0 else None
+        self.rules = rules  # rules.RuleStage applied by detect(), or None
+
+    def feature_matrix(self, flows):
+        """(n, n_inputs) matrix of the model's inputs for FlowStats objects; only those are computed."""
+        read = self._read
+        return np.array([read(flow) for flow in flows], dtype=np.float64).reshape(-1, len(self.features))
+
+    def inputs(self, X):
+        """The model's inputs out of a full (n, len(COLUMNS)) matrix; other matrices are returned as is."""
+        if X.shape[1] != len(self.features):
+            X = X[:, self.feature_index]
+        return X
+
+    def probabilities(self, X):
+        """
+        Class probabilities (n, n_classes) for a matrix from self.feature_matrix,
+        or a full (n, len(COLUMNS)) one.
+        """
+        X = self.inputs(X) * self.scale + self.offset
+        if self.clip is not None:
+            np.clip(X, self.clip[0], self.clip[1], out=X)
+        probs = self.booster.inplace_predict(X, iteration_range=self.iteration_range)
+        if probs.ndim == 1:  # binary:logistic gives P(class 1) only
+            probs = np.column_stack((1 - probs, probs))
+        return probs
+
+    def predict(self, X):
+        """
+        Scores a feature matrix (see probabilities).
+        Returns (class_idx, confidence) arrays; confidence is in percent.
+        Use self.labels[class_idx] / self.is_attack[class_idx] to read them.
+        """
+        cache = self.cache
+        if cache is None:
+            return self._predict(X)
+        # Unused inputs are left out of the key: they cannot change the prediction
+        X = self.inputs(X)
+        keys = cache.keys(X[:, self.used])
+        class_idx = np.empty(len(X), dtype=np.intp)
+        confidence = np.empty(len(X), dtype=np.float64)
+        missing = cache.lookup(keys, class_idx, confidence)
+        if missing:
+            rows = list(missing.values())
+            new_idx, new_conf = self._predict(X[[r[0] for r in rows]])
+            for r, c, p in zip(rows, new_idx, new_conf):
+                class_idx[r] = c
+                confidence[r] = p
+            cache.store(list(missing), new_idx, new_conf)
+        return class_idx, confidence
+
+    def _predict(self, X):
+        probs = self.probabilities(X)
+        class_idx = probs.argmax(axis=1)
+        confidence = probs[np.arange(len(class_idx)), class_idx] * 100
+        return class_idx, confidence
+
+    def set_threads(self, n):
+        """Limits the model to n threads (one per worker process when sharding)."""
+        self.booster.set_param({'nthread': n})
+
+    def detect(self, flows, batch_size=BATCH_SIZE):
+        """
+        Scores finished flows [(key, flow)] from a FlowTable.
+        Returns [(src_ip, dst_ip, src_port, dst_port, attack_type, confidence)] for the attacks.
+        """
+        alerts = []
+        if self.rules is not None:
+            flows, alerts = self.rules.apply(flows)
+        flows = [(k, f) for k, f in flows if f.packet_count >= MIN_PACKETS]
+        if self.rules is not None:
+            self.rules.count("model", len(flows))
+        for start in range(0, len(flows), batch_size):
+            batch = flows[start:start + batch_size]
+            BATCH_FLOWS.observe(len(batch))
+            with FEATURE_SECONDS.time():
+                X = self.feature_matrix(flow for _, flow in batch)
+            with INFERENCE_SECONDS.time():
+                class_idx, confidence = self.predict(X)
+            for i in np.flatnonzero(self.is_attack[class_idx]):
+                src_ip, dst_ip, src_port, dst_port, proto = endpoints(*batch[i])
+                alerts.append((src_ip, dst_ip, src_port, dst_port,
+                               self.labels[class_idx[i]], float(confidence[i])))
+        for alert in alerts:
+            DETECTIONS.inc(1, alert[4])
+        return alerts
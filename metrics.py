@@ -0,0 +1,222 @@
+"""
+Pipeline metrics in the Prometheus text format.
+
+Each module declares its metrics once at import time, on the module-level
+REGISTRY:
+
+    FEATURE_SECONDS = metrics.histogram('phoenix_feature_seconds', "...")
+    FEATURE_SECONDS.observe(elapsed)
+
+Counters and gauges can also read a value that is already kept elsewhere
+(fn=lambda: packet_queue.dropped), which costs nothing on the hot path,
+and can have one label (counter(..., label='rule'), inc(n, 'syn_flood')).
+
+serve() exposes the registry on a sidecar HTTP server (GET /metrics), in a
+daemon thread of the sniffer process. Sharded worker processes have their
+own registry: they send snapshot() to the parent, which keeps the latest
+one per worker (set_remote) and adds them into what it serves.
+
+No dependency on prometheus_client; only counters, gauges (with at most
+one label) and histograms (without).
+"""
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9108  # sidecar port (0 disables it)
+METRICS_HOST = '127.0.0.1'  # sidecar address: loopback only unless asked otherwise
+
+# Seconds, from 50 us to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 4, 16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, fn=None, label=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+        self.value = {} if label else 0  # label value -> value when labelled
+
+    def inc(self, n=1, label_value=None):
+        if self.label:
+            self.value[label_value] = self.value.get(label_value, 0) + n
+        else:
+            self.value += n
+
+    def sample(self):
+        value = self.fn() if self.fn is not None else self.value
+        return dict(value) if self.label else value
+
+    def lines(self, value):
+        if self.label:
+            return [f'{self.name}{{{self.label}="{k}"}} {_number(v)}' for k, v in sorted(value.items())]
+        return [f"{self.name} {_number(value)}"]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, label_value=None):
+        if self.label:
+            self.value[label_value] = value
+        else:
+            self.value = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """with HISTOGRAM.time(): ... observes the block's wall time."""
+        return _Timer(self)
+
+    def sample(self):
+        return (list(self.counts), self.sum)
+
+    def lines(self, value):
+        counts, total = value
+        out, cumulative = [], 0
+        for le, n in zip(self.buckets + ('+Inf',), counts):
+            cumulative += n
+            out.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        out.append(f"{self.name}_sum {_number(total)}")
+        out.append(f"{self.name}_count {cumulative}")
+        return out
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add(a, b):
+    if isinstance(a, tuple):  # histogram
+        return ([x + y for x, y in zip(a[0], b[0])], a[1] + b[1])
+    if isinstance(a, dict):   # labelled
+        return {k: a.get(k, 0) + b.get(k, 0) for k in a.keys() | b.keys()}
+    return a + b
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._remote = {}  # source (e.g. worker index) -> latest snapshot
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, fn=None, label=None):
+        return self._register(Counter(name, help, fn, label))
+
+    def gauge(self, name, help, fn=None, label=None):
+        return self._register(Gauge(name, help, fn, label))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def snapshot(self):
+        """{name: value} of every metric (histograms as (bucket counts, sum), labelled ones as dicts). Picklable."""
+        return {name: metric.sample() for name, metric in self._metrics.items()}
+
+    def set_remote(self, source, snapshot):
+        """Latest snapshot of another process; its values are added to this registry's."""
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def render(self):
+        """The Prometheus text exposition of this registry plus the remote snapshots."""
+        with self._lock:
+            remote = list(self._remote.values())
+        out = []
+        for name, metric in self._metrics.items():
+            value = metric.sample()
+            for snapshot in remote:
+                if name in snapshot:
+                    value = _add(value, snapshot[name])
+            out.append(f"# HELP {name} {metric.help}")
+            out.append(f"# TYPE {name} {metric.kind}")
+            out.extend(metric.lines(value))
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def resident_bytes():
+    """Resident set size of this process (Linux; 0 elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+gauge('phoenix_resident_bytes', "Resident memory of the sniffer (and its workers, summed)", fn=resident_bytes)
+
+
+def serve(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """Serves GET /metrics from a daemon thread. Returns the server; raises OSError if the port cannot be bound."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # one line per scrape would drown the alert log
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
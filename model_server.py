@@ -0,0 +1,234 @@
+"""
+One model shared by several sensors.
+
+web_app.py serves the model over HTTP; sensors started with
+--model-server URL (sniffer_service.py, RealTimeIDS.py) keep capture,
+flow accounting, feature extraction, the rule stage and their prediction
+cache, and send only the feature matrix of the flows the cache has not
+seen. Model memory is held once, by the server, and inference scales
+independently of capture.
+
+    GET  /api/model    {"features": [...], "used": [...], "labels": [...], ...}
+    POST /api/predict  rows of the model's inputs, in "features" order, as
+                       raw little-endian float64, row-major
+                       (Content-Type: application/octet-stream, with an
+                       X-Columns header giving the row width, which must
+                       be the model's input count), or as JSON
+                       {"rows": [[...], ...]}. JSON rows may also be full
+                       CICFlowMeter rows (all 78 COLUMNS); raw rows may not.
+                       ?probabilities=true adds the class probabilities.
+                    -> {"class": [...], "label": [...], "confidence": [...]}
+
+MicroBatcher scores the requests of concurrent callers together: the
+first request waits at most max_latency for others to join, then every
+request collected so far (up to max_rows rows) goes through one
+Detector.predict call and each caller gets its own slice back. Many
+sensors sending small windows thus cost one model call per max_latency,
+not one per window.
+"""
+import concurrent.futures
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import numpy as np
+import metrics
+from flow_features import COLUMNS
+from inference import Detector, CACHE_SIZE, CACHE_BITS
+
+MAX_LATENCY = 0.005  # seconds the first request of a batch waits for others
+MAX_ROWS = 65536     # rows per model call
+TIMEOUT = 30.0       # client: seconds to wait for the server
+
+SERVER_BATCH_ROWS = metrics.histogram('phoenix_model_server_batch_rows', "Rows per shared model call",
+                                      metrics.SIZE_BUCKETS)
+SERVER_BATCH_REQUESTS = metrics.histogram('phoenix_model_server_batch_requests',
+                                          "Requests answered by one shared model call", metrics.SIZE_BUCKETS)
+SERVER_WAIT_SECONDS = metrics.histogram('phoenix_model_server_wait_seconds',
+                                        "Time a request waited for its batch to be scored")
+
+
+class _Request:
+    __slots__ = ('X', 'probabilities', 'future', 'arrived')
+
+    def __init__(self, X, probabilities):
+        self.X = X
+        self.probabilities = probabilities
+        self.future = concurrent.futures.Future()
+        self.arrived = time.monotonic()
+
+
+class MicroBatcher:
+    def __init__(self, detector, max_latency=MAX_LATENCY, max_rows=MAX_ROWS):
+        self.detector = detector
+        self.max_latency = max_latency
+        self.max_rows = max_rows
+        self._q = queue.Queue()
+        self._thread = None
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def info(self):
+        """What a RemoteDetector needs to know about the model, plus batching figures."""
+        d = self.detector
+        return {"features": d.features, "used": d.used.tolist(), "labels": d.labels.tolist(),
+                "attack": d.is_attack.tolist(), "max_latency": self.max_latency, "max_rows": self.max_rows,
+                "requests": self.requests, "rows": self.rows, "batches": self.batches}
+
+    def submit(self, X, probabilities=False):
+        """
+        Queues rows for scoring. Returns a Future of {"class", "confidence"
+        (and "probabilities")} arrays. Raises ValueError on a matrix of the wrong width.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] not in (len(self.detector.features), len(COLUMNS)):
+            raise ValueError(f"expected rows of {len(self.detector.features)} model inputs "
+                             f"or {len(COLUMNS)} COLUMNS")
+        request = _Request(self.detector.inputs(X), probabilities)
+        self._q.put(request)
+        return request.future
+
+    def _run(self):
+        while True:
+            first = self._q.get()
+            batch, rows = [first], len(first.X)
+            deadline = first.arrived + self.max_latency
+            while rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request.X)
+            self._score(batch)
+
+    def _score(self, batch):
+        try:
+            X = np.concatenate([r.X for r in batch]) if len(batch) > 1 else batch[0].X
+            class_idx, confidence = self.detector.predict(X)
+            wanted = [r.X for r in batch if r.probabilities]
+            probs = self.detector.probabilities(np.concatenate(wanted)) if wanted else None
+        except Exception as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        self.rows += len(X)
+        SERVER_BATCH_ROWS.observe(len(X))
+        SERVER_BATCH_REQUESTS.observe(len(batch))
+        now = time.monotonic()
+        start = p = 0
+        for r in batch:
+            end = start + len(r.X)
+            result = {"class": class_idx[start:end], "confidence": confidence[start:end]}
+            if r.probabilities:
+                result["probabilities"] = probs[p:p + len(r.X)]
+                p += len(r.X)
+            SERVER_WAIT_SECONDS.observe(now - r.arrived)
+            r.future.set_result(result)
+            start = end
+
+
+def decode_rows(body, content_type, width, columns=None):
+    """
+    The matrix of a POST /api/predict body. A raw float64 body must state
+    its row width (`columns`, the X-Columns header), and it must be `width`,
+    the model's input count. Raises ValueError when the body is malformed.
+    """
+    if content_type.startswith('application/json'):
+        try:
+            return np.asarray(json.loads(body)["rows"], dtype=np.float64)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"expected {{\"rows\": [[...], ...]}}: {e}") from None
+    if columns is None:
+        raise ValueError("raw float64 bodies need an X-Columns header")
+    if str(columns).strip() != str(width):
+        raise ValueError(f"raw rows must hold the {width} model inputs (X-Columns: {columns})")
+    if len(body) % (8 * width):
+        raise ValueError(f"body is not a whole number of rows of {width} float64 values")
+    return np.frombuffer(body, dtype='<f8').reshape(-1, width)
+
+
+def result_json(detector, result):
+    """The response body for a scored request."""
+    out = {"class": result["class"].tolist(), "label": detector.labels[result["class"]].tolist(),
+           "confidence": result["confidence"].tolist()}
+    if "probabilities" in result:
+        out["probabilities"] = result["probabilities"].tolist()
+    return json.dumps(out)
+
+
+class RemoteDetector(Detector):
+    """
+    Detector whose model runs on a shared server (web_app.py). Features,
+    the rule stage and the prediction cache stay in this process, so
+    detect() / predict() behave as Detector's; only cache misses are sent.
+    Raises RuntimeError (or OSError) when the server cannot be reached.
+    """
+
+    def __init__(self, url, cache_size=CACHE_SIZE, cache_bits=CACHE_BITS, rules=None, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url if '://' in url else f"http://{url}")
+        self.url = url
+        self._https = parts.scheme == 'https'
+        self._host = parts.netloc
+        self._prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._conn = None
+        meta = json.loads(self._request('GET', '/api/model'))
+        self._setup(meta["labels"], meta["features"], meta["used"], cache_size, cache_bits, rules)
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in (0, 1):  # once more if the server closed the kept-alive connection
+            if self._conn is None:
+                cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+                self._conn = cls(self._host, timeout=self.timeout)
+            try:
+                self._conn.request(method, self._prefix + path, body, headers or {})
+                response = self._conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f"model server {self.url}: {response.status} "
+                                   f"{data[:200].decode(errors='replace')}")
+            return data
+
+    def _score(self, X, probabilities=False):
+        X = np.ascontiguousarray(self.inputs(X), dtype='<f8')
+        path = '/api/predict?probabilities=true' if probabilities else '/api/predict'
+        return json.loads(self._request('POST', path, X.tobytes(),
+                                        {'Content-Type': 'application/octet-stream',
+                                         'X-Columns': str(X.shape[1])}))
+
+    def probabilities(self, X):
+        return np.asarray(self._score(X, True)["probabilities"], dtype=np.float64).reshape(len(X), -1)
+
+    def _predict(self, X):
+        result = self._score(X)
+        return np.asarray(result["class"], dtype=np.intp), np.asarray(result["confidence"], dtype=np.float64)
+
+    def set_threads(self, n):
+        pass  # the server decides
+
+
+def load_detector(model_server=None, **options):
+    """A RemoteDetector when a model server URL is given, else a local Detector."""
+    if model_server:
+        return RemoteDetector(model_server, **options)
+    return Detector(**options)
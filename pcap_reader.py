@@ -0,0 +1,237 @@
+"""
+Fast offline reader for pcap / pcapng captures.
+
+Capture files are memory-mapped and only the link, IPv4 and TCP/UDP
+headers are unpacked with precompiled structs, no scapy dissection. Every
+packet comes out as the same record the live capture path produces:
+
+    (src_ip, dst_ip, src_port, dst_port, proto, ts, payload_len, header_len, flags, window)
+
+Payload length is taken from the IP header, so captures taken with a
+short snaplen (headers only) give the same features as full ones.
+
+Supported: classic pcap (either byte order, micro/nanosecond timestamps),
+pcapng (EPB/SPB blocks, per-interface link type and if_tsresol), link
+types Ethernet (with 802.1Q/802.1ad tags), raw IP, Linux SLL/SLL2 and BSD
+loopback.
+"""
+import mmap
+import os
+import struct
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng', '.cap', '.dmp')
+
+_ETH_IPV4 = 0x0800
+_ETH_VLAN = (0x8100, 0x88A8, 0x9100)
+
+_IPV4 = struct.Struct('!BBHHHBBHII')
+_TCP = struct.Struct('!HHIIBBH')
+_PORTS = struct.Struct('!HH')
+_U16 = struct.Struct('!H')
+
+
+def parse_ipv4(buf, off, end, ts):
+    """Parses an IPv4 packet starting at buf[off] (captured bytes end at `end`)."""
+    if off + 20 > end:
+        return None
+    vihl, _, total_len, _, frag, _, proto, _, src, dst = _IPV4.unpack_from(buf, off)
+    if vihl >> 4 != 4 or frag & 0x1FFF:
+        return None  # not IPv4, or a non-first fragment (no L4 header)
+    ihl = (vihl & 0x0F) * 4
+    if total_len == 0:
+        total_len = end - off  # TSO / offloaded captures
+    l4 = off + ihl
+    if proto == 6:
+        if l4 + 16 > end:
+            return None
+        sport, dport, _, _, offset, flags, window = _TCP.unpack_from(buf, l4)
+        hlen = (offset >> 4) * 4
+        return (src, dst, sport, dport, 6, ts, max(total_len - ihl - hlen, 0), hlen, flags, window)
+    if proto == 17:
+        if l4 + 8 > end:
+            return None
+        sport, dport = _PORTS.unpack_from(buf, l4)
+        return (src, dst, sport, dport, 17, ts, max(total_len - ihl - 8, 0), 8, 0, -1)
+    return None
+
+
+def parse_frame(buf, off, end, linktype, ts):
+    """Parses one captured frame buf[off:end] of the given link type; None if not IPv4 TCP/UDP."""
+    if linktype == LINKTYPE_ETHERNET:
+        if off + 14 > end:
+            return None
+        ethertype = _U16.unpack_from(buf, off + 12)[0]
+        off += 14
+        while ethertype in _ETH_VLAN and off + 4 <= end:
+            ethertype = _U16.unpack_from(buf, off + 2)[0]
+            off += 4
+        if ethertype != _ETH_IPV4:
+            return None
+    elif linktype == LINKTYPE_RAW or linktype == LINKTYPE_IPV4:
+        pass
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if off + 16 > end or _U16.unpack_from(buf, off + 14)[0] != _ETH_IPV4:
+            return None
+        off += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if off + 20 > end or _U16.unpack_from(buf, off)[0] != _ETH_IPV4:
+            return None
+        off += 20
+    elif linktype == LINKTYPE_NULL:
+        # Address family in the capturing host's byte order; AF_INET is 2 everywhere
+        if off + 4 > end or buf[off:off + 4] not in (b'\x02\x00\x00\x00', b'\x00\x00\x00\x02'):
+            return None
+        off += 4
+    else:
+        return None
+    return parse_ipv4(buf, off, end, ts)
+
+
+def _read_pcap(buf):
+    magic = buf[:4]
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    else:
+        endian = '>'
+    scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + 'IIII')
+    off, size = 24, len(buf)
+    while off + 16 <= size:
+        sec, frac, caplen, _ = record.unpack_from(buf, off)
+        off += 16
+        end = min(off + caplen, size)
+        parsed = parse_frame(buf, off, end, linktype, sec + frac * scale)
+        if parsed is not None:
+            yield parsed
+        off += caplen
+
+
+def _tsresol(options, endian):
+    """if_tsresol option of an Interface Description Block -> seconds per tick."""
+    pos = 0
+    while pos + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            v = options[pos + 4]
+            return 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0 ** -v
+        pos += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _read_pcapng(buf):
+    size = len(buf)
+    off = 0
+    endian = '<'
+    interfaces = []  # [(linktype, seconds per tick)]
+    ts = 0.0
+    while off + 12 <= size:
+        if buf[off:off + 4] == b'\x0a\x0d\x0d\x0a':
+            # Section Header Block: byte order may change per section
+            endian = '<' if buf[off + 8:off + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        block_type, block_len = struct.unpack_from(endian + 'II', buf, off)
+        if block_len < 12:
+            break
+        body = off + 8
+        if block_type == 6:  # Enhanced Packet Block
+            iface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', buf, body)
+            linktype, resol = interfaces[iface] if iface < len(interfaces) else (LINKTYPE_ETHERNET, 1e-6)
+            ts = ((ts_high << 32) | ts_low) * resol
+            data = body + 20
+            parsed = parse_frame(buf, data, min(data + caplen, size), linktype, ts)
+            if parsed is not None:
+                yield parsed
+        elif block_type == 3:  # Simple Packet Block (no timestamp: reuse the last one)
+            linktype = interfaces[0][0] if interfaces else LINKTYPE_ETHERNET
+            data = body + 4
+            end = min(off + block_len - 4, size)
+            parsed = parse_frame(buf, data, end, linktype, ts)
+            if parsed is not None:
+                yield parsed
+        elif block_type == 1:  # Interface Description Block
+            linktype = struct.unpack_from(endian + 'H', buf, body)[0]
+            options = buf[body + 8:off + block_len - 4]
+            interfaces.append((linktype, _tsresol(options, endian)))
+        off += block_len
+
+
+def read_packets(path):
+    """Yields a record for every IPv4 TCP/UDP packet of a pcap or pcapng file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 24:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:4] == b'\x0a\x0d\x0d\x0a':
+                yield from _read_pcapng(buf)
+            elif buf[:4] in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4',
+                             b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'):
+                yield from _read_pcap(buf)
+            else:
+                raise ValueError("not a pcap/pcapng file")
+
+
+def is_capture_file(name):
+    """True for a capture file name, including tcpdump -C rotations (dump.pcap1, dump.pcap2...)."""
+    return name.lower().rstrip('0123456789').endswith(CAPTURE_EXTENSIONS)
+
+
+def capture_files(paths):
+    """
+    Expands paths into capture files. Directories (e.g. rotated captures from
+    tcpdump -C / -G) contribute their capture files, oldest first.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = [os.path.join(path, name) for name in os.listdir(path) if is_capture_file(name)]
+            entries.sort(key=lambda p: (os.path.getmtime(p), p))
+            files.extend(entries)
+        else:
+            files.append(path)
+    return files
+
+
+def capture_packets(paths):
+    """
+    Yields the records of every capture file of paths in turn. A file that
+    cannot be opened or is not a capture is skipped with a warning, so one
+    bad file in a rotation directory does not stop the replay.
+    """
+    for path in capture_files(paths):
+        try:
+            yield from read_packets(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"⚠️ Skipping {path}: {e}")
+
+
+def replay(paths, flow_table, on_finished, sweep_interval=1.0):
+    """
+    Drives every packet of the given captures through flow_table, using
+    capture time as the clock. on_finished(flows) receives the flows that
+    end along the way (every sweep_interval capture-seconds) and, at the
+    end, everything still open. Returns the number of packets read.
+    """
+    n = 0
+    next_sweep = None
+    add = flow_table.add
+    for record in capture_packets(paths):
+        ts = record[5]
+        if next_sweep is None:
+            next_sweep = ts + sweep_interval
+        elif ts >= next_sweep:
+            on_finished(flow_table.expire(ts))
+            next_sweep = ts + sweep_interval
+        add(*record)
+        n += 1
+    on_finished(flow_table.flush())
+    return n
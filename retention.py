@@ -0,0 +1,111 @@
+"""
+Day-partitioned alert storage: sealing, rollups and retention.
+
+`alerts` only holds the current (UTC) day. The first maintenance run after
+midnight seals it:
+  - it is renamed to alerts_YYYYMMDD (a metadata change, no row copying),
+  - its incidents are rolled up into per-minute and per-hour totals by
+    attack type (alert_rollup_minute / alert_rollup_hour),
+  - a fresh `alerts` takes over, with ids continuing where it stopped.
+Partitions whose newest incident is older than raw_days are dropped whole
+(DROP TABLE, never a row-by-row DELETE); minute rollups are kept for
+minute_days and hour rollups for hour_days (0 = forever). The all-time
+alert_summary totals are not affected by drops.
+
+alerts_history is a UNION ALL view over the live table and every sealed
+partition (see setup_db.create_history_view), so the dashboard and the
+history browser see one table whose size is bounded by raw_days.
+
+maintain() must run on the single writer's connection (AlertWriter does).
+"""
+import time
+from setup_db import create_alert_indexes, create_alerts_table, create_history_view
+
+RAW_DAYS = 7        # incidents are kept this long
+MINUTE_DAYS = 30    # per-minute rollups
+HOUR_DAYS = 365     # per-hour rollups (0 = forever)
+
+_ROLLUP = '''
+    INSERT INTO alert_rollup_{period} (bucket, attack_type, incidents, hits, confidence_sum, max_confidence)
+    SELECT substr(timestamp, 1, {width}), attack_type, COUNT(*), SUM(hit_count), TOTAL(confidence), MAX(confidence)
+    FROM {table} WHERE attack_type IS NOT NULL GROUP BY 1, 2
+    ON CONFLICT (bucket, attack_type) DO UPDATE SET
+        incidents = incidents + excluded.incidents,
+        hits = hits + excluded.hits,
+        confidence_sum = confidence_sum + excluded.confidence_sum,
+        max_confidence = MAX(max_confidence, excluded.max_confidence)
+'''
+# Bucket = prefix of the 'YYYY-MM-DD HH:MM:SS' timestamp
+BUCKET_WIDTH = {'minute': 16, 'hour': 13}
+
+
+def _utc(now, days=0, fmt='%Y-%m-%d %H:%M:%S'):
+    return time.strftime(fmt, time.gmtime(now - days * 86400))
+
+
+def _seal(c, first_seen, last_seen):
+    """Turns the live table into a day partition. Runs inside the caller's transaction."""
+    name = base = 'alerts_' + first_seen[:10].replace('-', '')
+    n = 1
+    while c.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone():
+        n += 1
+        name = f'{base}_{n}'
+
+    # The view would be rewritten to follow the rename: rebuild it afterwards
+    c.execute('DROP VIEW IF EXISTS alerts_history')
+    c.execute(f'ALTER TABLE alerts RENAME TO {name}')
+    # Indexes and triggers moved with the table but keep their alerts names; the
+    # partition is never written again, so it gets its own indexes and no triggers
+    for row in c.execute("SELECT type, name FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+                         "AND name NOT LIKE 'sqlite_%'", (name,)).fetchall():
+        c.execute(f'DROP {row[0].upper()} {row[1]}')
+    create_alert_indexes(c, name)
+
+    for period, width in BUCKET_WIDTH.items():
+        c.execute(_ROLLUP.format(period=period, width=width, table=name))
+
+    create_alerts_table(c)
+    # AUTOINCREMENT state was renamed along with the table: carry it over
+    c.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'alerts', seq FROM sqlite_sequence WHERE name = ?",
+              (name,))
+    c.execute('INSERT INTO alert_partitions (name, first_seen, last_seen) VALUES (?, ?, ?)',
+              (name, first_seen, last_seen))
+    return name
+
+
+def maintain(conn, now=None, raw_days=RAW_DAYS, minute_days=MINUTE_DAYS, hour_days=HOUR_DAYS):
+    """
+    Seals the live table if it holds an earlier day, drops expired partitions
+    and prunes old rollups. Returns (sealed partition or None, dropped partitions).
+    """
+    now = time.time() if now is None else now
+    today = _utc(now, fmt='%Y-%m-%d')
+    c = conn.cursor()
+    sealed, dropped = None, []
+    conn.commit()
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        first_seen = c.execute('SELECT MIN(timestamp) FROM alerts').fetchone()[0]  # index lookup
+        if first_seen is not None and first_seen < today:
+            last_seen = c.execute('SELECT MAX(COALESCE(last_seen, timestamp)) FROM alerts').fetchone()[0]
+            sealed = _seal(c, first_seen, last_seen)
+
+        cutoff = _utc(now, raw_days)
+        dropped = [row[0] for row in c.execute('SELECT name FROM alert_partitions WHERE last_seen < ?',
+                                               (cutoff,)).fetchall()]
+        for name in dropped:
+            c.execute(f'DROP TABLE {name}')
+            c.execute('DELETE FROM alert_partitions WHERE name = ?', (name,))
+        if sealed or dropped:
+            create_history_view(c)
+
+        c.execute('DELETE FROM alert_rollup_minute WHERE bucket < ?', (_utc(now, minute_days)[:16],))
+        if hour_days:
+            c.execute('DELETE FROM alert_rollup_hour WHERE bucket < ?', (_utc(now, hour_days)[:13],))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if dropped:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+    return sealed, dropped
@@ -0,0 +1,141 @@
+"""
+Rule stage in front of the model.
+
+Some traffic does not need XGBoost to be classified: high-volume known-good
+traffic (internal DNS, backup replication) and obvious floods or scans.
+RuleStage.apply() looks at one window of finished flows (one sweep of the
+flow table) and takes those out before inference:
+
+  - allow_net:  either endpoint is in an allowlisted subnet   -> benign
+  - allow_port: the server (destination) port is allowlisted  -> benign
+  - syn_flood:  a source opened at least flood_flows flows in the window
+                and at least syn_ratio of them are SYN without ACK
+                -> its SYN-only flows get flood_label
+  - port_scan:  a source probed at least scan_ports distinct ports of
+                one destination in the window -> its probes of that
+                destination get scan_label. A probe is a flow that never
+                became a conversation: SYN without ACK, no reply at all,
+                or no payload either way (refused with RST, or a
+                handshake and nothing else); established sessions to
+                many service ports are left to the model.
+
+Rules run before the model's minimum packet count, so the single-SYN flows
+of a flood or scan are counted even though the model never sees them.
+`counts` tells how many flows each rule absorbed (Detector.detect adds
+"model": flows that went on to inference), to tune the thresholds against
+model load.
+
+Everything else goes to the model unchanged. A threshold of 0 disables
+its rule.
+
+Thresholds apply per RuleStage, and with --workers N every worker has its
+own, seeing only the flows of its shard. Flows are sharded by their
+5-tuple, so one source's flows (and one scan's ports) spread over all N
+workers: a scan then needs about N x scan_ports ports, and a flood N x
+flood_flows flows, before any worker's rule fires.
+"""
+import ipaddress
+from collections import Counter, defaultdict
+import metrics
+from flow_table import forward_key, int_to_ip
+
+FLOOD_FLOWS = 100     # flows per source per window before the SYN ratio is checked
+SYN_RATIO = 0.9       # share of SYN-without-ACK flows that makes it a flood
+SCAN_PORTS = 50       # distinct ports of one destination per source per window
+FLOOD_LABEL = "DoS"
+SCAN_LABEL = "Port Scanning"
+RULE_CONFIDENCE = 100.0
+
+RULE_FLOWS = metrics.counter('phoenix_rule_flows_total',
+                             "Flows decided by each rule (model: passed on to inference)", label='rule')
+
+
+def _probe(flow):
+    """True for a flow that never became a conversation (see port_scan above)."""
+    return (flow.syn and not flow.ack) or not flow.bwd_len.n or not (flow.fwd_len.total or flow.bwd_len.total)
+
+
+def _nets(cidrs):
+    """[(network, mask)] as ints for IPv4 CIDRs. Raises ValueError on malformed ones."""
+    nets = [ipaddress.IPv4Network(c, strict=False) for c in cidrs]
+    return [(int(n.network_address), int(n.netmask)) for n in nets]
+
+
+class RuleStage:
+    def __init__(self, allow_nets=(), allow_ports=(), flood_flows=FLOOD_FLOWS, syn_ratio=SYN_RATIO,
+                 scan_ports=SCAN_PORTS, flood_label=FLOOD_LABEL, scan_label=SCAN_LABEL):
+        self.allow_nets = _nets(allow_nets)
+        self.allow_ports = frozenset(int(p) for p in allow_ports)
+        if any(not 0 <= p <= 65535 for p in self.allow_ports):
+            raise ValueError(f"invalid port in {allow_ports}")
+        self.flood_flows = flood_flows
+        self.syn_ratio = syn_ratio
+        self.scan_ports = scan_ports
+        self.flood_label = flood_label
+        self.scan_label = scan_label
+        self.counts = Counter()  # rule -> flows absorbed
+
+    def count(self, rule, n=1):
+        self.counts[rule] += n
+        RULE_FLOWS.inc(n, rule)
+
+    def _allowed(self, ip):
+        for net, mask in self.allow_nets:
+            if ip & mask == net:
+                return True
+        return False
+
+    def apply(self, flows):
+        """
+        Splits one window of finished flows [(key, flow)].
+        Returns (flows left for the model, alerts decided by a rule); the
+        alerts are (src_ip, dst_ip, src_port, dst_port, attack_type, confidence).
+        """
+        counts = Counter()
+        rest = []  # (key, flow, forward key)
+        for key, flow in flows:
+            fk = forward_key(key, flow)
+            if self.allow_nets and (self._allowed(fk[0]) or self._allowed(fk[1])):
+                counts["allow_net"] += 1
+            elif fk[3] in self.allow_ports:
+                counts["allow_port"] += 1
+            else:
+                rest.append((key, flow, fk))
+
+        # Per-source statistics for the window
+        per_source = defaultdict(list)
+        for item in rest:
+            per_source[item[2][0]].append(item)
+
+        alerts, left = [], []
+        for items in per_source.values():
+            flooding = False
+            if self.flood_flows and len(items) >= self.flood_flows:
+                syn_only = sum(1 for _, flow, _ in items if flow.syn and not flow.ack)
+                flooding = syn_only >= self.syn_ratio * len(items)
+            scanned, probes = set(), ()
+            if self.scan_ports and len(items) >= self.scan_ports:
+                probes = {id(flow) for _, flow, _ in items if _probe(flow)}
+                ports = defaultdict(set)
+                for _, flow, fk in items:
+                    if id(flow) in probes:
+                        ports[fk[1]].add(fk[3])
+                scanned = {dst for dst, p in ports.items() if len(p) >= self.scan_ports}
+
+            for key, flow, fk in items:
+                if fk[1] in scanned and id(flow) in probes:  # a SYN scan is a scan, not a flood
+                    rule, label = "port_scan", self.scan_label
+                elif flooding and flow.syn and not flow.ack:
+                    rule, label = "syn_flood", self.flood_label
+                else:
+                    left.append((key, flow))
+                    continue
+                counts[rule] += 1
+                alerts.append((int_to_ip(fk[0]), int_to_ip(fk[1]), fk[2], fk[3], label, RULE_CONFIDENCE))
+        for rule, n in counts.items():
+            self.count(rule, n)
+        return left, alerts
+
+    def summary(self):
+        """'rule count, ...' for the log, busiest rule first."""
+        return ", ".join(f"{rule} {n}" for rule, n in self.counts.most_common()) or "no flows"
@@ -1,10 +1,35 @@
 import sqlite3
 
-def init_db():
-    conn = sqlite3.connect('ids_logs.db')
-    c = conn.cursor()
-    
-    # Create table for Alerts
+DB_PATH = 'ids_logs.db'
+
+_ADD = '''
+        INSERT INTO alert_summary (attack_type, incidents, hits, confidence_sum)
+        VALUES (NEW.attack_type, 1, NEW.hit_count, COALESCE(NEW.confidence, 0))
+        ON CONFLICT (attack_type) DO UPDATE SET
+            incidents = incidents + 1,
+            hits = hits + excluded.hits,
+            confidence_sum = confidence_sum + excluded.confidence_sum;
+'''
+_REMOVE = '''
+        UPDATE alert_summary SET
+            incidents = incidents - 1,
+            hits = hits - OLD.hit_count,
+            confidence_sum = confidence_sum - COALESCE(OLD.confidence, 0)
+        WHERE attack_type = OLD.attack_type;
+'''
+SUMMARY_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS alerts_summary_insert AFTER INSERT ON alerts BEGIN {_ADD} END',
+    f'''CREATE TRIGGER IF NOT EXISTS alerts_summary_update
+        AFTER UPDATE OF attack_type, hit_count, confidence ON alerts BEGIN {_REMOVE} {_ADD} END''',
+    f'CREATE TRIGGER IF NOT EXISTS alerts_summary_delete AFTER DELETE ON alerts BEGIN {_REMOVE} END',
+)
+
+ALERT_COLUMNS = "id, timestamp, src_ip, dst_ip, src_port, dst_port, attack_type, confidence, last_seen, hit_count"
+
+def create_alerts_table(c):
+    """The live alerts table (today's partition, see retention.py) with its indexes and summary triggers"""
+    # One row per incident: repeated detections of the same (src_ip, dst_ip, dst_port, attack_type)
+    # are folded in by the sniffer. timestamp = first seen, confidence = highest seen.
     c.execute('''
         CREATE TABLE IF NOT EXISTS alerts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -14,10 +39,93 @@ def init_db():
             src_port INTEGER,
             dst_port INTEGER,
             attack_type TEXT,
-            confidence REAL
+            confidence REAL,
+            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            hit_count INTEGER NOT NULL DEFAULT 1
         )
     ''')
     
+    # Databases created before incidents were aggregated
+    columns = {row[1] for row in c.execute('PRAGMA table_info(alerts)')}
+    if 'last_seen' not in columns:
+        c.execute('ALTER TABLE alerts ADD COLUMN last_seen DATETIME')
+        c.execute('UPDATE alerts SET last_seen = timestamp')
+    if 'hit_count' not in columns:
+        c.execute('ALTER TABLE alerts ADD COLUMN hit_count INTEGER NOT NULL DEFAULT 1')
+    
+    create_alert_indexes(c, 'alerts')
+    for statement in SUMMARY_TRIGGERS:
+        c.execute(statement)
+
+def create_alert_indexes(c, table):
+    """Indexes for looking alerts up by type, source or time (newest first within each)"""
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_type ON {table} (attack_type, id)')
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_src ON {table} (src_ip, id)')
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table} (timestamp)')
+
+def create_history_view(c):
+    """alerts_history: the live table and every sealed day partition, as one table"""
+    partitions = [row[0] for row in c.execute('SELECT name FROM alert_partitions ORDER BY name')]
+    c.execute('DROP VIEW IF EXISTS alerts_history')
+    c.execute('CREATE VIEW alerts_history AS ' + ' UNION ALL '.join(
+        f'SELECT {ALERT_COLUMNS} FROM {table}' for table in ['alerts'] + partitions))
+
+def init_db(db_path=DB_PATH):
+    """Creates the tables, or brings an existing database up to date. Safe to run repeatedly."""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    
+    # Lets retention give the pages of dropped partitions back to the OS
+    # (takes effect on a new database; existing ones reuse the freed pages instead)
+    c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    # WAL: the dashboard can read while the sniffer writes (the setting is stored in the file)
+    c.execute('PRAGMA journal_mode=WAL')
+    
+    # Per attack type totals (all time: retention drops partitions without touching them)
+    # are kept up to date by triggers on the live table, so the dashboard reads one row
+    # per class instead of scanning alerts
+    conn.commit()
+    c.execute('BEGIN IMMEDIATE')  # no alert can slip in between the backfill and the triggers
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'alert_summary'").fetchone()
+    create_alerts_table(c)
+    if not exists:
+        c.execute('''
+            CREATE TABLE alert_summary (
+                attack_type TEXT PRIMARY KEY,
+                incidents INTEGER NOT NULL,
+                hits INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL
+            )
+        ''')
+        c.execute('''
+            INSERT INTO alert_summary (attack_type, incidents, hits, confidence_sum)
+            SELECT attack_type, COUNT(*), SUM(hit_count), TOTAL(confidence) FROM alerts GROUP BY attack_type
+        ''')
+    
+    # Sealed day partitions (alerts_YYYYMMDD, see retention.py) and the rollups
+    # that outlive them: per-minute and per-hour totals by attack type
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS alert_partitions (
+            name TEXT PRIMARY KEY,
+            first_seen DATETIME,
+            last_seen DATETIME
+        )
+    ''')
+    for period in ('minute', 'hour'):
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS alert_rollup_{period} (
+                bucket TEXT NOT NULL,
+                attack_type TEXT NOT NULL,
+                incidents INTEGER NOT NULL,
+                hits INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                max_confidence REAL,
+                PRIMARY KEY (bucket, attack_type)
+            ) WITHOUT ROWID
+        ''')
+    create_history_view(c)
+    conn.commit()
+    
     # Create table for Live Stats (optional, to show traffic volume)
     c.execute('''
         CREATE TABLE IF NOT EXISTS stats (
@@ -29,7 +137,7 @@ def init_db():
     
     conn.commit()
     conn.close()
-    print("✅ Database 'ids_logs.db' initialized successfully!")
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
+    print(f"✅ Database '{DB_PATH}' initialized successfully!")
\ No newline at end of file
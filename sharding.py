@@ -0,0 +1,256 @@
+"""
+Multi-process detection: packets are fanned out to N worker processes by a
+symmetric flow hash, so both directions of a flow land on the same worker.
+Each worker owns its own FlowTable and model copy; alerts are merged back
+into the parent process, which stays the single DB writer.
+
+The capture side only parses, hashes and packs each record into a
+per-worker binary batch (far cheaper to send between processes than
+pickled tuples); full batches go to the worker's queue with put_nowait,
+and batches that do not fit are dropped and counted instead of stalling
+capture. A flusher thread sends partial batches every SEND_INTERVAL, so
+the last packets of a flow (its FIN/RST) reach the worker even when the
+link goes quiet.
+
+Workers send a snapshot of their metrics after every sweep; the parent
+adds them into what its /metrics sidecar serves.
+
+A worker that dies mid-run (OOM, a crash in the model) is reported with
+its exit code; its packets are then dropped and counted, and close()
+neither waits on its queue nor for its results.
+"""
+import multiprocessing
+import queue
+import struct
+import sys
+import threading
+import time
+import metrics
+from flow_table import FlowTable, flow_hash, shard
+from inference import INFERENCE_ERRORS
+from model_server import load_detector
+from pcap_reader import capture_packets
+
+SEND_BATCH = 1024         # packets per inter-process message
+SEND_INTERVAL = 0.1       # flush partial batches this often (seconds)
+READY_POLL = 0.5          # how often start(), the collector and blocking sends check that workers are alive
+CLOSE_TIMEOUT = 60.0      # close(): seconds to wait for workers to score their last flows
+
+# One packet record: src_ip, dst_ip, src_port, dst_port, proto, ts, payload_len, header_len, flags, window
+_RECORD = struct.Struct('=IIHHBdiHBi')
+_BATCH_BYTES = SEND_BATCH * _RECORD.size
+
+
+def _worker(index, packets, results, idle_timeout, active_timeout, analysis_interval, live,
+            detector_options, table_options):
+    try:
+        detector = load_detector(**detector_options)
+    except (OSError, RuntimeError) as e:
+        where = detector_options.get("model_server") or "the model files"
+        print(f"❌ Worker {index} cannot load the model from {where}: {e}")
+        sys.exit(1)
+    detector.set_threads(1)
+
+    def score(flows):
+        try:
+            alerts = detector.detect(flows)
+        except Exception as e:
+            INFERENCE_ERRORS.inc()
+            print(f"❌ Worker {index} Inference Error: {e}")
+            alerts = []
+        if alerts:
+            results.put(('alerts', alerts))
+        results.put(('metrics', (index, metrics.REGISTRY.snapshot())))
+
+    table = FlowTable(idle_timeout, active_timeout, on_evict=score, **table_options)
+    results.put(('ready', index))
+    clock = 0.0
+    next_sweep = None
+    while True:
+        try:
+            batch = packets.get(timeout=analysis_interval)
+        except queue.Empty:
+            batch = b''
+        if batch is None:
+            break
+        add = table.add
+        for record in _RECORD.iter_unpack(batch):
+            add(*record)
+        # Live capture expires on the wall clock, replay on the capture's own clock
+        if live:
+            clock = time.time()
+        elif batch:
+            clock = _RECORD.unpack_from(batch, len(batch) - _RECORD.size)[5]
+        if next_sweep is None:
+            next_sweep = clock + analysis_interval
+        elif clock >= next_sweep:
+            next_sweep = clock + analysis_interval
+            score(table.expire(clock))
+
+    score(table.flush())
+    if detector.cache is not None:
+        cache = detector.cache
+        print(f"🧠 Worker {index} prediction cache: {cache.hit_rate():.1%} hit rate "
+              f"({cache.hits} cached, {cache.misses} scored by the model)")
+    if detector.rules is not None:
+        print(f"🧮 Worker {index} flows by rule: {detector.rules.summary()}")
+    if table.overload_summary():
+        print(f"⚠️ Worker {index} flow table overload: {table.overload_summary()}")
+    results.put(('done', index))
+
+
+class ShardedPipeline:
+    def __init__(self, workers, on_alert, idle_timeout, active_timeout,
+                 analysis_interval=1.0, queue_size=500000, live=True, detector_options=None,
+                 table_options=None):
+        # spawn: a fresh interpreter per worker, no forked XGBoost/OpenMP state
+        ctx = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.on_alert = on_alert
+        self.received = 0
+        self.dropped = 0
+        self.alerts = 0
+        self._results = ctx.Queue()
+        self._queues = [ctx.Queue(maxsize=max(queue_size // SEND_BATCH, 1)) for _ in range(workers)]
+        self._pending = [bytearray() for _ in range(workers)]
+        self._pending_lock = threading.Lock()  # put() (capture thread) vs the flusher
+        self._closing = threading.Event()
+        self._live = live
+        self._procs = [
+            ctx.Process(target=_worker, daemon=True,
+                        args=(i, q, self._results, idle_timeout, active_timeout, analysis_interval, live,
+                              detector_options or {}, table_options or {}))
+            for i, q in enumerate(self._queues)
+        ]
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._ready = threading.Semaphore(0)
+        self._finished = set()  # workers that sent 'done' or died (collector thread)
+        self.failed = {}        # worker index -> exit code, for workers that died
+
+    def start(self):
+        """
+        Starts the workers and waits until every one has loaded its model.
+        Raises RuntimeError (after stopping the others) if a worker exits first.
+        """
+        for p in self._procs:
+            p.start()
+        self._collector.start()
+        ready = 0
+        while ready < self.workers:
+            if self._ready.acquire(timeout=READY_POLL):
+                ready += 1
+                continue
+            dead = [(i, p.exitcode) for i, p in enumerate(self._procs) if not p.is_alive()]
+            if dead:
+                for p in self._procs:
+                    p.terminate()
+                i, code = dead[0]
+                raise RuntimeError(f"detection worker {i} exited with code {code} before it was ready")
+        if self._live:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _collect(self):
+        # Single consumer of every worker's alerts: the one place that writes them out
+        ready = set()
+        while len(self._finished) < self.workers:
+            try:
+                kind, payload = self._results.get(timeout=READY_POLL)
+            except queue.Empty:
+                # Nothing pending: a worker that has exited without 'done' will never send it
+                for i, p in enumerate(self._procs):
+                    if i not in self._finished and p.exitcode is not None:
+                        self._finished.add(i)
+                        self.failed[i] = p.exitcode
+                        self._queues[i].cancel_join_thread()
+                        if i in ready:  # start() reports the ones that die while loading
+                            print(f"❌ Detection worker {i} exited with code {p.exitcode}; "
+                                  f"its packets are dropped from now on")
+                continue
+            if kind == 'ready':
+                ready.add(payload)
+                self._ready.release()
+            elif kind == 'alerts':
+                for alert in payload:
+                    self.alerts += 1
+                    self.on_alert(*alert)
+            elif kind == 'metrics':
+                metrics.REGISTRY.set_remote(*payload)
+            elif kind == 'done':
+                self._finished.add(payload)
+
+    def _send(self, i):
+        batch, self._pending[i] = bytes(self._pending[i]), bytearray()
+        try:
+            self._queues[i].put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch) // _RECORD.size
+
+    def put(self, record):
+        """Routes one parsed packet record (or None) to its worker. Never blocks."""
+        if record is None:
+            return
+        self.received += 1
+        i = shard(flow_hash(*record[:5]), self.workers)
+        with self._pending_lock:
+            pending = self._pending[i]
+            pending += _RECORD.pack(*record)
+            if len(pending) >= _BATCH_BYTES:
+                self._send(i)
+
+    def _put(self, i, item):
+        """Blocking send to worker i; gives up (returns False) once the worker has died."""
+        while self._procs[i].is_alive():
+            try:
+                self._queues[i].put(item, timeout=READY_POLL)
+                return True
+            except queue.Full:
+                pass
+        # Batches already buffered for the dead worker would block this process's exit
+        self._queues[i].cancel_join_thread()
+        if item:
+            self.dropped += len(item) // _RECORD.size
+        return False
+
+    def _flush_loop(self):
+        # Partial batches go out every SEND_INTERVAL whether or not more packets arrive
+        while not self._closing.wait(SEND_INTERVAL):
+            with self._pending_lock:
+                for i in range(self.workers):
+                    if self._pending[i]:
+                        self._send(i)
+
+    def close(self):
+        """Flushes pending packets, lets every worker score its remaining flows, and waits for the alerts."""
+        self._closing.set()
+        with self._pending_lock:
+            for i in range(self.workers):
+                if self._pending[i]:
+                    self._put(i, bytes(self._pending[i]))
+                    self._pending[i] = bytearray()
+                self._put(i, None)
+        deadline = time.monotonic() + CLOSE_TIMEOUT
+        self._collector.join(CLOSE_TIMEOUT)
+        for i, p in enumerate(self._procs):
+            p.join(max(deadline - time.monotonic(), 0))
+            if p.is_alive():
+                p.terminate()
+                p.join()
+                self.failed.setdefault(i, p.exitcode)
+                print(f"❌ Detection worker {i} did not finish within {CLOSE_TIMEOUT:.0f}s: terminated")
+
+    def replay(self, paths):
+        """
+        Feeds capture files through the workers (blocking when they fall
+        behind rather than dropping) and waits for the result. Returns the packet count.
+        """
+        n = 0
+        pending, pack = self._pending, _RECORD.pack
+        for record in capture_packets(paths):
+            i = shard(flow_hash(*record[:5]), self.workers)
+            pending[i] += pack(*record)
+            if len(pending[i]) >= _BATCH_BYTES:
+                self._put(i, bytes(pending[i]))
+                pending[i] = bytearray()
+            n += 1
+        self.close()
+        return n
@@ -1,135 +1,290 @@
 import time
-import sqlite3
-import joblib
-import pandas as pd
-import numpy as np
-from scapy.all import sniff, IP, TCP, UDP
-from collections import defaultdict
-
-# 1. LOAD MODELS
-print("🧠 Loading AI Models...")
-model = joblib.load('xgboost_final.pkl')
-scaler = joblib.load('scaler_final.pkl')
-le = joblib.load('label_encoder_final.pkl')
+import argparse
+import threading
+from scapy.all import sniff
+from alert_writer import AlertWriter
+from capture import (PacketQueue, parse_packet, build_filter, raw_capture,
+                     DEFAULT_FILTER, SNAPLEN)
+from flow_table import FlowTable, MAX_FLOWS, EVICTION, EVICTIONS, DEGRADED, DEGRADED_MODES, SAMPLE_RATE
+from inference import ensure_exported, CACHE_SIZE, CACHE_BITS, INFERENCE_ERRORS
+import metrics
+from model_server import load_detector
+from pcap_reader import replay
+import retention
+import rules
+from sharding import ShardedPipeline
+
+# 1. MODELS (loaded by load_models() at start-up, so worker processes
+# importing this module don't each load an extra copy)
+detector = None
+
+def load_models(**detector_options):
+    global detector
+    if detector_options.get("model_server"):
+        print(f"🧠 Using the model server at {detector_options['model_server']}...")
+    else:
+        print("🧠 Loading AI Models...")
+    try:
+        detector = load_detector(**detector_options)
+    except (OSError, RuntimeError) as e:
+        where = detector_options.get("model_server") or "the model files"
+        raise SystemExit(f"❌ Cannot load the model from {where}: {e}")
 
 # 2. CONFIGURATION
 DB_PATH = 'ids_logs.db'
-active_flows = defaultdict(list)
-
-# Columns must match training data EXACTLY
-COLUMNS = [
-    'Destination Port', 'Flow Duration', 'Total Fwd Packets',
-    'Total Backward Packets', 'Total Length of Fwd Packets', 
-    'Total Length of Bwd Packets', 'Fwd Packet Length Max', 
-    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 
-    'Fwd Packet Length Std', 'Bwd Packet Length Max', 
-    'Bwd Packet Length Min', 'Bwd Packet Length Mean', 
-    'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s', 
-    'Flow IAT Mean', 'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min',
-    'Fwd IAT Total', 'Fwd IAT Mean', 'Fwd IAT Std', 'Fwd IAT Max',
-    'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std',
-    'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
-    'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length',
-    'Bwd Header Length', 'Fwd Packets/s', 'Bwd Packets/s',
-    'Min Packet Length', 'Max Packet Length', 'Packet Length Mean',
-    'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count',
-    'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count',
-    'ACK Flag Count', 'URG Flag Count', 'CWE Flag Count',
-    'ECE Flag Count', 'Down/Up Ratio', 'Average Packet Size',
-    'Avg Fwd Segment Size', 'Avg Bwd Segment Size',
-    'Fwd Header Length.1', 'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk',
-    'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk',
-    'Bwd Avg Bulk Rate', 'Subflow Fwd Packets', 'Subflow Fwd Bytes',
-    'Subflow Bwd Packets', 'Subflow Bwd Bytes', 'Init_Win_bytes_forward',
-    'Init_Win_bytes_backward', 'act_data_pkt_fwd', 'min_seg_size_forward',
-    'Active Mean', 'Active Std', 'Active Max', 'Active Min',
-    'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
-]
+IDLE_TIMEOUT = 60      # seconds without packets before a flow ends
+ACTIVE_TIMEOUT = 120   # longest a single flow may run before it is cut
+ANALYSIS_INTERVAL = 1  # how often finished flows are collected and scored
+DRAIN_INTERVAL = 0.1   # how often captured packets are moved into the flow table
+QUEUE_SIZE = 500000    # captured packets waiting for the analysis thread
+
+# Capture thread -> packet_queue -> analysis thread (sole owner of flow_table)
+packet_queue = PacketQueue(QUEUE_SIZE)
+flow_table = FlowTable(IDLE_TIMEOUT, ACTIVE_TIMEOUT)
+# Detection -> alert_writer (folds repeats into incidents) -> one WAL-mode connection
+alert_writer = AlertWriter(DB_PATH)
+
+# 3. METRICS (GET /metrics on --metrics-port)
+pipeline = None  # ShardedPipeline when running with --workers > 1
+
+def capture_stat(name):
+    return lambda: getattr(pipeline if pipeline is not None else packet_queue, name)
+
+metrics.counter('phoenix_packets_received_total', "Packets handed over by capture", fn=capture_stat('received'))
+metrics.counter('phoenix_packets_dropped_total', "Packets dropped because detection fell behind",
+                fn=capture_stat('dropped'))
+metrics.counter('phoenix_packets_late_total', "Packets drained after their flow's expiry sweep",
+                fn=lambda: packet_queue.late)
+metrics.gauge('phoenix_packet_queue_depth', "Captured packets waiting for the analysis thread",
+              fn=lambda: len(packet_queue))
+metrics.gauge('phoenix_alert_queue_depth', "Detections waiting for the alert writer", fn=alert_writer.backlog)
+metrics.counter('phoenix_alert_writer_total', "Alert writer activity", label='event',
+                fn=lambda: {"queued": alert_writer.queued, "dropped": alert_writer.dropped,
+                            "inserted": alert_writer.inserted, "updated": alert_writer.updated,
+                            "failed": alert_writer.failed})
 
 def log_alert(src_ip, dst_ip, src_port, dst_port, attack_type, confidence):
-    """Writes the attack to SQLite database"""
+    """Queues the attack for the SQLite writer thread (never blocks detection)"""
+    alert_writer.put(src_ip, dst_ip, src_port, dst_port, attack_type, confidence)
+
+def score_flows(flows):
+    """Predicts a batch of finished flows and logs the attacks"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO alerts (src_ip, dst_ip, src_port, dst_port, attack_type, confidence)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (src_ip, dst_ip, src_port, dst_port, attack_type, float(confidence)))
-        conn.commit()
-        conn.close()
-        print(f"🚨 LOGGED: {attack_type} from {src_ip}")
+        alerts = detector.detect(flows)
     except Exception as e:
-        print(f"❌ DB Error: {e}")
-
-def extract_features(flow_key, packets):
-    # (Simplified feature extraction logic from previous step)
-    start_time = packets[0].time
-    end_time = packets[-1].time
-    duration = (end_time - start_time) * 1000000 
-    
-    fwd_pkts = [p for p in packets if p[IP].src == flow_key[0]]
-    bwd_pkts = [p for p in packets if p[IP].src == flow_key[1]]
-    
-    features = {col: 0 for col in COLUMNS}
+        INFERENCE_ERRORS.inc()
+        print(f"❌ Inference Error: {e}")
+        return
     
-    features['Destination Port'] = flow_key[3] if flow_key[3] else 0
-    features['Flow Duration'] = duration
-    features['Total Fwd Packets'] = len(fwd_pkts)
-    features['Total Backward Packets'] = len(bwd_pkts)
-    features['Total Length of Fwd Packets'] = sum(len(p) for p in fwd_pkts)
-    features['Total Length of Bwd Packets'] = sum(len(p) for p in bwd_pkts)
-    
-    return pd.DataFrame([features], columns=COLUMNS)
+    # If Attack, Save to DB
+    for alert in alerts:
+        log_alert(*alert)
 
 def process_flow():
-    """Analyzes traffic every 3 seconds"""
+    """Folds captured packets into flows and scores flows as they finish (idle/active timeout or FIN/RST)"""
+    swept = time.time()
+    reported = (0, 0)
+    overloaded = False
     while True:
-        time.sleep(3)
-        current_flows = list(active_flows.items())
-        active_flows.clear() # Reset for next batch
+        time.sleep(DRAIN_INTERVAL)
+        add = flow_table.add
+        for record in packet_queue.drain():
+            if record[5] < swept:
+                packet_queue.late += 1
+            add(*record)
         
-        if not current_flows: continue
+        now = time.time()
+        if now - swept < ANALYSIS_INTERVAL: continue
+        swept = now
         
-        for flow_key, packets in current_flows:
-            if len(packets) < 2: continue 
-
-            try:
-                # Predict
-                df_input = extract_features(flow_key, packets)
-                input_scaled = scaler.transform(df_input)
-                
-                pred_idx = model.predict(input_scaled)[0]
-                pred_label = le.inverse_transform([pred_idx])[0]
-                
-                # If Attack, Save to DB
-                if pred_label not in ["BENIGN", "Normal Traffic"]:
-                    probs = model.predict_proba(input_scaled)[0]
-                    confidence = np.max(probs) * 100
-                    
-                    src_ip, dst_ip, src_port, dst_port, proto = flow_key
-                    log_alert(src_ip, dst_ip, src_port, dst_port, pred_label, confidence)
-                    
-            except Exception as e:
-                pass
-
-def packet_callback(packet):
-    if IP in packet and (TCP in packet or UDP in packet):
-        src_ip = packet[IP].src
-        dst_ip = packet[IP].dst
-        if TCP in packet:
-            src_port, dst_port, proto = packet[TCP].sport, packet[TCP].dport, "TCP"
-        else:
-            src_port, dst_port, proto = packet[UDP].sport, packet[UDP].dport, "UDP"
-            
-        flow_key = (src_ip, dst_ip, src_port, dst_port, proto)
-        active_flows[flow_key].append(packet)
+        if (packet_queue.dropped, packet_queue.late) != reported:
+            reported = (packet_queue.dropped, packet_queue.late)
+            print(f"⚠️ Capture backlog: {reported[0]} dropped, {reported[1]} late packets so far")
+        if flow_table.overloaded and not overloaded:
+            print(f"⚠️ Flow table full ({flow_table.max_flows} flows): degraded mode '{flow_table.degraded}'")
+        elif overloaded and not flow_table.overloaded:
+            print(f"✅ Flow table recovered: {flow_table.overload_summary()} so far")
+        overloaded = flow_table.overloaded
+        
+        score_flows(flow_table.expire(now))
+
+def capture_live(on_record, args):
+    """
+    Captures from the interface with the BPF filter applied in the kernel and
+    hands every parsed packet record to on_record (runs on the capture thread: never block).
+    """
+    bpf = build_filter(args.filter, args.exclude_net, args.exclude_port)
+    print(f"🔎 Capture filter: {bpf}")
+    if args.capture == 'raw':
+        raw_capture(on_record, args.iface, bpf, args.snaplen)
+    else:
+        def packet_callback(packet):
+            record = parse_packet(packet)
+            if record is not None:
+                on_record(record)
+        sniff(prn=packet_callback, store=0, filter=bpf, iface=args.iface)
+
+def replay_captures(paths):
+    """Runs pcap/pcapng files (or directories of them) through the same flow + inference pipeline"""
+    print(f"📼 Replaying {', '.join(paths)}...")
+    flows = 0
+    def on_finished(finished):
+        nonlocal flows
+        flows += len(finished)
+        score_flows(finished)
+    start = time.perf_counter()
+    packets = replay(paths, flow_table, on_finished, ANALYSIS_INTERVAL)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Replay done: {packets} packets, {flows} flows in {elapsed:.1f}s "
+          f"({packets / max(elapsed, 1e-9):,.0f} packets/s)")
+
+def build_rules(args):
+    """The rule stage from the command line (None when every rule is off)."""
+    if not (args.allow_net or args.allow_port or args.flood_flows or args.scan_ports):
+        return None
+    return rules.RuleStage(args.allow_net, args.allow_port, args.flood_flows, args.syn_ratio, args.scan_ports)
+
+def build_flow_table(args):
+    """The flow table sized and set up from the command line (scores evicted flows with score_flows)."""
+    return FlowTable(IDLE_TIMEOUT, ACTIVE_TIMEOUT, args.max_flows, args.eviction, args.degraded,
+                     args.sample_rate, on_evict=score_flows)
+
+def run_sharded(workers, paths, detector_options, table_options, args):
+    """
+    Fans packets out to worker processes by flow hash (both directions of a
+    flow go to the same worker); alerts come back to this process, the single DB writer.
+    """
+    global pipeline
+    if not detector_options.get("model_server"):
+        ensure_exported()  # once here, not racing in every worker
+    pipeline = ShardedPipeline(workers, log_alert, IDLE_TIMEOUT, ACTIVE_TIMEOUT,
+                               ANALYSIS_INTERVAL, QUEUE_SIZE, live=not paths,
+                               detector_options=detector_options, table_options=table_options)
+    print(f"🧠 Starting {workers} detection workers...")
+    try:
+        pipeline.start()
+    except RuntimeError as e:
+        raise SystemExit(f"❌ {e} (see its error above)")
+    if paths:
+        print(f"📼 Replaying {', '.join(paths)}...")
+        start = time.perf_counter()
+        packets = pipeline.replay(paths)
+        elapsed = time.perf_counter() - start
+        print(f"✅ Replay done: {packets} packets in {elapsed:.1f}s "
+              f"({packets / max(elapsed, 1e-9):,.0f} packets/s)")
+        if pipeline.failed:
+            print(f"⚠️ {pipeline.dropped} packets dropped: worker(s) "
+                  f"{', '.join(map(str, sorted(pipeline.failed)))} died during the replay")
+        return
+    print(f"🛡️ Sniffer Service Started ({workers} workers, writing to DB)...")
+    try:
+        capture_live(pipeline.put, args)
+    finally:
+        pipeline.close()
 
 if __name__ == "__main__":
-    import threading
-    # Start analysis in background
-    t = threading.Thread(target=process_flow)
-    t.daemon = True
-    t.start()
+    parser = argparse.ArgumentParser(description="Phoenix detection engine")
+    parser.add_argument('--pcap', nargs='+', metavar='PATH',
+                        help="replay pcap/pcapng files or directories instead of sniffing live")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="detection processes; >1 shards flows across processes by flow hash")
+    parser.add_argument('--iface', help="interface to sniff (default: all / scapy's default)")
+    parser.add_argument('--capture', choices=('scapy', 'raw'), default='scapy',
+                        help="raw: Linux AF_PACKET socket with header-only parsing (fastest)")
+    parser.add_argument('--filter', default=DEFAULT_FILTER, help="BPF filter applied in the kernel")
+    parser.add_argument('--exclude-net', action='append', default=[], metavar='CIDR',
+                        help="trusted subnet to drop in the kernel (repeatable)")
+    parser.add_argument('--exclude-port', action='append', default=[], type=int, metavar='PORT',
+                        help="trusted port to drop in the kernel (repeatable)")
+    parser.add_argument('--snaplen', type=int, default=SNAPLEN,
+                        help="bytes copied per frame on the raw path (headers only)")
+    parser.add_argument('--keep-days', type=int, default=retention.RAW_DAYS,
+                        help="days of individual alerts kept (older day partitions are dropped)")
+    parser.add_argument('--keep-minute-days', type=int, default=retention.MINUTE_DAYS,
+                        help="days of per-minute rollups kept")
+    parser.add_argument('--keep-hour-days', type=int, default=retention.HOUR_DAYS,
+                        help="days of per-hour rollups kept (0 = forever)")
+    parser.add_argument('--model-server', metavar='URL',
+                        help="score flows on a shared model server (web_app.py, e.g. http://ids:8000) "
+                             "instead of loading the model here")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help="feature vectors whose prediction is cached (0 disables the cache)")
+    parser.add_argument('--cache-bits', type=int, default=CACHE_BITS, choices=range(1, 53), metavar='1-52',
+                        help="precision of the cache key: mantissa bits kept per feature (52, the default, is an "
+                             "exact match; fewer lets nearly equal flows share a verdict, ports and counts stay exact)")
+    parser.add_argument('--allow-net', action='append', default=[], metavar='CIDR',
+                        help="trusted subnet: its flows are captured but never sent to the model (repeatable)")
+    parser.add_argument('--allow-port', action='append', default=[], type=int, metavar='PORT',
+                        help="trusted server port: its flows are never sent to the model (repeatable)")
+    parser.add_argument('--flood-flows', type=int, default=rules.FLOOD_FLOWS,
+                        help="flows per source per sweep before the SYN flood rule applies (0 = off)")
+    parser.add_argument('--syn-ratio', type=float, default=rules.SYN_RATIO,
+                        help="share of SYN-without-ACK flows that makes a source a flood")
+    parser.add_argument('--scan-ports', type=int, default=rules.SCAN_PORTS,
+                        help="distinct ports of one host probed per source per sweep that make a port scan (0 = off); "
+                             "with --workers N each worker counts its own shard, so a scan needs ~N times this")
+    parser.add_argument('--max-flows', type=int, default=MAX_FLOWS,
+                        help="flows tracked at once, ~2 KB each (0 = unbounded; split across --workers)")
+    parser.add_argument('--eviction', choices=EVICTIONS, default=EVICTION,
+                        help="flows making room in a full table: oldest/smallest are dropped, "
+                             "score scores the oldest before dropping them")
+    parser.add_argument('--degraded', choices=DEGRADED_MODES, default=DEGRADED,
+                        help="new conversations while the table is full: track one in --sample-rate, "
+                             "fold them into one flow per source, or track them all (off)")
+    parser.add_argument('--sample-rate', type=int, default=SAMPLE_RATE,
+                        help="degraded 'sample' mode tracks one new conversation in this many")
+    parser.add_argument('--metrics-port', type=int, default=metrics.METRICS_PORT,
+                        help="port of the Prometheus /metrics endpoint (0 = off)")
+    parser.add_argument('--metrics-host', default=metrics.METRICS_HOST,
+                        help="address the /metrics endpoint listens on (0.0.0.0 exposes it to the network)")
+    args = parser.parse_args()
     
-    print("🛡️ Sniffer Service Started (Writing to DB)...")
-    sniff(prn=packet_callback, store=0)
\ No newline at end of file
+    try:
+        build_filter(args.filter, args.exclude_net, args.exclude_port)  # a bad --exclude-net fails here, not at capture
+        if args.cache_size < 0:
+            raise ValueError(f"--cache-size must be >= 0 (0 disables the cache), got {args.cache_size}")
+        detector_options = {"cache_size": args.cache_size, "cache_bits": args.cache_bits,
+                            "rules": build_rules(args), "model_server": args.model_server}
+        flow_table = build_flow_table(args)
+    except ValueError as e:
+        parser.error(str(e))
+    # Each worker holds its share of --max-flows
+    table_options = {"max_flows": -(-args.max_flows // max(args.workers, 1)), "eviction": args.eviction,
+                     "degraded": args.degraded, "sample_rate": args.sample_rate}
+    alert_writer.retention = {"raw_days": args.keep_days, "minute_days": args.keep_minute_days,
+                              "hour_days": args.keep_hour_days}
+    alert_writer.start()
+    if args.metrics_port:
+        try:
+            metrics.serve(args.metrics_port, args.metrics_host)
+            print(f"📈 Metrics on http://{args.metrics_host}:{args.metrics_port}/metrics")
+        except OSError as e:
+            print(f"⚠️ Metrics endpoint not started ({args.metrics_host}:{args.metrics_port}: {e})")
+    try:
+        if args.workers > 1:
+            run_sharded(args.workers, args.pcap, detector_options, table_options, args)
+        elif args.pcap:
+            load_models(**detector_options)
+            replay_captures(args.pcap)
+        else:
+            load_models(**detector_options)
+            
+            # Start analysis in background
+            t = threading.Thread(target=process_flow)
+            t.daemon = True
+            t.start()
+            
+            print("🛡️ Sniffer Service Started (Writing to DB)...")
+            capture_live(packet_queue.put, args)
+    finally:
+        if detector is not None and detector.cache is not None:
+            cache = detector.cache
+            print(f"🧠 Prediction cache: {cache.hit_rate():.1%} hit rate "
+                  f"({cache.hits} cached, {cache.misses} scored by the model)")
+        if detector is not None and detector.rules is not None:
+            print(f"🧮 Flows by rule: {detector.rules.summary()}")
+        if flow_table.overload_summary():
+            print(f"⚠️ Flow table overload: {flow_table.overload_summary()}")
+        alert_writer.close()
+        print(f"💾 Alerts: {alert_writer.queued} detections -> {alert_writer.inserted} incidents, "
+              f"{alert_writer.dropped} dropped, {alert_writer.failed} failed writes")
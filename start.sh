@@ -7,7 +7,8 @@ python3 setup_db.py
 
 # 2. Start Sniffer in Background (&)
 # We don't need 'sudo' inside Docker because Docker runs as root by default
-python3 sniffer_service.py &
+# /metrics listens on all interfaces so Prometheus can scrape the container (port 9108)
+python3 sniffer_service.py --metrics-host 0.0.0.0 &
 
 # 3. Start Web Dashboard
 # Host 0.0.0.0 is required to be accessible outside the container
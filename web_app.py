@@ -1,12 +1,98 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import json
+import shutil
 import sqlite3
+import tempfile
+import threading
+import time
 import uvicorn
 import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from retention import BUCKET_WIDTH
+from setup_db import init_db
 
-app = FastAPI()
+DB_PATH = 'ids_logs.db'
+STREAM_INTERVAL = 0.25  # how often /api/stream checks the database for new commits
+STREAM_BACKLOG = 100    # events buffered per client; a client that falls further behind is dropped
+KEEPALIVE = 15          # seconds between SSE comments on an idle stream
+POOL_SIZE = 4           # read-only connections shared by the /api/alerts handlers
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+UPLOAD_COPY_BYTES = 1 << 20  # /api/score spools uploads to disk in blocks of this size
+
+def connect_ro():
+    # Used from whichever worker thread runs the query, never two at once
+    return sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, check_same_thread=False)
+
+class ReadPool:
+    """
+    Fixed set of read-only connections for async handlers. A handler awaits
+    a free connection, the query runs in a worker thread (sqlite3 blocks),
+    and the connection goes back to the pool, so the event loop never waits
+    on SQLite and no request opens its own connection.
+    """
+    def __init__(self, size):
+        self._idle = asyncio.Queue()
+        self._all = []
+        for _ in range(size):
+            conn = connect_ro()
+            self._all.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def run(self, query, *args):
+        """Awaits query(cursor, *args) on a pooled connection."""
+        conn = await self._idle.get()
+        try:
+            return await asyncio.to_thread(query, conn.cursor(), *args)
+        finally:
+            self._idle.put_nowait(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+pool = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global pool
+    # Make sure the summary table and indexes exist before the first poll
+    init_db(DB_PATH)
+    pool = ReadPool(POOL_SIZE)
+    task = asyncio.create_task(stream.run())
+    yield
+    task.cancel()
+    pool.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# /api/data response cache. PRAGMA data_version changes whenever another connection
+# commits (new incident *or* an update to an open one, which max(id) would miss), and
+# reading it touches no table pages. Only this connection's values are comparable,
+# so it is shared behind the lock.
+_cache_lock = threading.Lock()
+_cache = {"version": None, "etag": None, "body": None, "generation": 0}
+_boot = f"{int(time.time()):x}"  # keeps ETags from a previous run from matching
+_watch_conn = None
+
+def cached_data():
+    """(etag, body) for the current database state; queries only after a commit."""
+    global _watch_conn
+    with _cache_lock:
+        if _watch_conn is None:
+            _watch_conn = connect_ro()
+        version = _watch_conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != _cache["version"]:
+            _cache["body"] = query_data(_watch_conn.cursor())
+            _cache["version"] = version
+            _cache["generation"] += 1
+            _cache["etag"] = f'"{_boot}-{_cache["generation"]}"'
+        return _cache["etag"], _cache["body"]
 
 # HTML Template (Embed code directly for simplicity)
 
@@ -20,45 +106,343 @@ def dashboard(request: Request):
 
 
 @app.get("/api/data")
-def get_data():
-    conn = sqlite3.connect('ids_logs.db')
-    c = conn.cursor()
-    
-    # 1. Recent Alerts
-    c.execute("SELECT timestamp, attack_type, src_ip, dst_ip, dst_port, confidence FROM alerts ORDER BY id DESC LIMIT 10")
+async def get_data(request: Request):
+    etag, body = await asyncio.to_thread(cached_data)
+    # no-cache: browsers revalidate every poll, and an unchanged poll is a bodyless 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+def recent_alerts(c, limit=10):
+    """Newest incidents first; hits = detections folded into the incident"""
+    c.execute("SELECT id, COALESCE(last_seen, timestamp), attack_type, src_ip, dst_ip, dst_port, confidence, hit_count FROM alerts_history ORDER BY id DESC LIMIT ?", (limit,))
+    return [{
+        "id": r[0],
+        "time": r[1].split()[1], # Just take the time part
+        "type": r[2],
+        "src": r[3],
+        "dst": r[4],
+        "dport": r[5],
+        "conf": int(r[6]),
+        "hits": r[7]
+    } for r in c.fetchall()]
+
+def read_summary(c):
+    """attack_type -> (hits, incidents, confidence_sum), from the trigger-maintained summary"""
+    c.execute("SELECT attack_type, hits, incidents, confidence_sum FROM alert_summary WHERE incidents > 0")
+    return {r[0]: r[1:] for r in c.fetchall()}
+
+def summary_stats(summary):
+    # Distribution (for Chart), counted in detections
+    distribution = {attack: v[0] for attack, v in summary.items()}
+    incidents = sum(v[1] for v in summary.values())
+    return {
+        "total_count": sum(distribution.values()),
+        "avg_confidence": round(sum(v[2] for v in summary.values()) / incidents, 1) if incidents else 0,
+        "distribution": distribution,
+        "top_attack": max(distribution, key=distribution.get) if distribution else "None"
+    }
+
+def query_data(c):
+    return {"recent_alerts": recent_alerts(c), **summary_stats(read_summary(c))}
+
+
+def parse_time(value, name):
+    """
+    ISO date/time -> the 'YYYY-MM-DD HH:MM:SS' UTC form of the timestamp
+    column. A value with an offset (or Z) is converted to UTC; one without
+    is taken as UTC already.
+    """
+    if value is None:
+        return None
+    try:
+        t = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith(('Z', 'z')) else value)
+        if t.tzinfo is not None:
+            t = t.astimezone(timezone.utc)
+        return t.strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name}: expected an ISO date/time, got {value!r}")
+
+def query_alerts(c, limit, before_id, src_ip, attack_type, since, until):
+    """
+    One page of incidents, newest first. Keyset pagination: the next page is
+    everything with id < the last id of this one, so every page is an index
+    seek whatever the depth (no OFFSET scanning).
+    """
+    where, args = [], []
+    if before_id is not None:
+        where.append("id < ?"); args.append(before_id)
+    if src_ip:
+        where.append("src_ip = ?"); args.append(src_ip)
+    if attack_type:
+        where.append("attack_type = ?"); args.append(attack_type)
+    if since:
+        where.append("timestamp >= ?"); args.append(since)
+    if until:
+        where.append("timestamp < ?"); args.append(until)
+    sql = ("SELECT id, timestamp, COALESCE(last_seen, timestamp), src_ip, src_port, dst_ip, dst_port, "
+           "attack_type, confidence, hit_count FROM alerts_history")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    c.execute(sql + " ORDER BY id DESC LIMIT ?", (*args, limit + 1))
     rows = c.fetchall()
     alerts = [{
-        "time": r[0].split()[1], # Just take the time part
+        "id": r[0],
+        "first_seen": r[1],
+        "last_seen": r[2],
+        "src": r[3],
+        "sport": r[4],
+        "dst": r[5],
+        "dport": r[6],
+        "type": r[7],
+        "conf": r[8],
+        "hits": r[9]
+    } for r in rows[:limit]]
+    return {
+        "alerts": alerts,
+        # Pass back as before_id for the next (older) page; null on the last page
+        "next_before_id": alerts[-1]["id"] if len(rows) > limit else None
+    }
+
+@app.get("/api/alerts")
+async def list_alerts(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      before_id: int = Query(None, ge=1),
+                      src_ip: str = None,
+                      attack_type: str = None,
+                      since: str = Query(None, description="first seen at or after (UTC, ISO format)"),
+                      until: str = Query(None, description="first seen before (UTC, ISO format)")):
+    """Browse the alert history: filter by source, type and time range, page with before_id"""
+    return await pool.run(query_alerts, limit, before_id, src_ip, attack_type,
+                          parse_time(since, "since"), parse_time(until, "until"))
+
+
+def query_timeline(c, period, since, until, attack_type):
+    """
+    Per-minute or per-hour totals by attack type: rollups of the sealed days,
+    plus the live day grouped on the fly (it holds at most one day of incidents).
+    Buckets are attributed to each incident's first-seen time.
+    """
+    width = BUCKET_WIDTH[period]
+    type_filter = " AND attack_type = ?" if attack_type else ""
+    extra = (attack_type,) if attack_type else ()
+    c.execute(f"""
+        SELECT bucket, attack_type, incidents, hits, max_confidence FROM alert_rollup_{period}
+        WHERE bucket >= ? AND bucket < ?{type_filter}
+        UNION ALL
+        SELECT substr(timestamp, 1, {width}), attack_type, COUNT(*), SUM(hit_count), MAX(confidence) FROM alerts
+        WHERE timestamp >= ? AND timestamp < ? AND attack_type IS NOT NULL{type_filter}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """, (since[:width], until[:width], *extra, since, until, *extra))
+    return [{
+        "bucket": r[0],
         "type": r[1],
-        "src": r[2],
-        "dst": r[3],
-        "dport": r[4],
-        "conf": int(r[5])
-    } for r in rows]
-    
-    # 2. Stats
-    c.execute("SELECT COUNT(*), AVG(confidence) FROM alerts")
-    stats = c.fetchone()
-    total_count = stats[0]
-    avg_conf = round(stats[1], 1) if stats[1] else 0
-    
-    # 3. Distribution (for Chart)
-    c.execute("SELECT attack_type, COUNT(*) FROM alerts GROUP BY attack_type")
-    dist_rows = c.fetchall()
-    distribution = {r[0]: r[1] for r in dist_rows}
-    
-    # 4. Top Attack
-    top_attack = max(distribution, key=distribution.get) if distribution else "None"
+        "incidents": r[2],
+        "hits": r[3],
+        "max_conf": r[4]
+    } for r in c.fetchall()]
+
+@app.get("/api/timeline")
+async def timeline(period: str = Query("minute", pattern="^(minute|hour)$"),
+                   since: str = Query(None, description="default: 1 day (minute) / 7 days (hour) ago; UTC, ISO format"),
+                   until: str = Query(None, description="UTC, ISO format"),
+                   attack_type: str = None):
+    """Attack volume over time, from the retention rollups"""
+    now = time.time()
+    default_since = now - (86400 if period == "minute" else 7 * 86400)
+    since = parse_time(since, "since") or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(default_since))
+    until = parse_time(until, "until") or "9999-12-31 23:59:59"
+    return await pool.run(query_timeline, period, since, until, attack_type)
+
+
+class AlertStream:
+    """
+    Watches the database for commits (PRAGMA data_version) and pushes what
+    changed to every /api/stream client: "alerts" for new incidents,
+    "update" for shown incidents that were hit again, "stats" with the
+    attack types whose totals moved. Values are absolute, so a delta that
+    overlaps a client's snapshot is harmless.
+    """
+    def __init__(self):
+        self.clients = set()  # one asyncio.Queue per connected client
+        self._conn = None
+        self._version = None
+        self._recent = {}     # id -> alert, as last pushed
+        self._summary = {}
+
+    def _poll(self):
+        """Runs in a worker thread, one call at a time. Returns [(event, data)]."""
+        if self._conn is None:
+            self._conn = connect_ro()
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._version:
+            return []
+        self._version = version
+        c = self._conn.cursor()
+        recent, summary = recent_alerts(c), read_summary(c)
+        
+        events = []
+        newest = max(self._recent, default=0)
+        new = [a for a in reversed(recent) if a["id"] > newest]
+        if new:
+            events.append(("alerts", new))
+        updated = [a for a in recent if a["id"] in self._recent and a != self._recent[a["id"]]]
+        if updated:
+            events.append(("update", updated))
+        if summary != self._summary:
+            stats = summary_stats(summary)
+            stats["distribution"] = {attack: summary[attack][0] if attack in summary else 0
+                                     for attack in summary.keys() | self._summary.keys()
+                                     if summary.get(attack) != self._summary.get(attack)}
+            events.append(("stats", stats))
+        self._recent = {a["id"]: a for a in recent}
+        self._summary = summary
+        return events
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(STREAM_INTERVAL)
+            if not self.clients:
+                continue
+            try:
+                events = await asyncio.to_thread(self._poll)
+            except sqlite3.Error as e:
+                print(f"❌ Stream DB Error: {e}")
+                continue
+            for queue in list(self.clients):
+                for event in events:
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        self.clients.discard(queue)  # it reconnects and gets a fresh snapshot
+                        break
+
+stream = AlertStream()
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/api/stream")
+async def alert_stream():
+    """Server-Sent Events: a "snapshot" (same body as /api/data), then deltas as alerts are written"""
+    queue = asyncio.Queue(STREAM_BACKLOG)
+    stream.clients.add(queue)  # before the snapshot, so nothing committed after it is missed
+    _, snapshot = await asyncio.to_thread(cached_data)
     
-    conn.close()
+    async def events():
+        try:
+            yield sse("snapshot", snapshot)
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if queue not in stream.clients:
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse(event, data)
+        finally:
+            stream.clients.discard(queue)
     
-    return {
-        "recent_alerts": alerts,
-        "total_count": total_count,
-        "avg_confidence": avg_conf,
-        "distribution": distribution,
-        "top_attack": top_attack
-    }
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Bulk scoring (bulk_score.py) and the shared model server (model_server.py) use
+# one model, loaded by the first /api/score or /api/predict request, so the
+# dashboard itself starts without XGBoost / pandas.
+_detector = None
+_batcher = None
+_detector_lock = threading.Lock()
+
+# Micro-batching of /api/predict: the first request of a batch waits this long for others
+PREDICT_MAX_LATENCY = float(os.environ.get('PHOENIX_PREDICT_MAX_LATENCY_MS', 5)) / 1000
+PREDICT_MAX_ROWS = int(os.environ.get('PHOENIX_PREDICT_MAX_ROWS', 65536))
+
+def scoring_detector():
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            from inference import Detector
+            # No prediction cache: answers are exact, sensors cache (at their own precision) on their side
+            _detector = Detector(cache_size=0)
+        return _detector
+
+def model_batcher():
+    global _batcher
+    detector = scoring_detector()
+    with _detector_lock:
+        if _batcher is None:
+            from model_server import MicroBatcher
+            _batcher = MicroBatcher(detector, PREDICT_MAX_LATENCY, PREDICT_MAX_ROWS).start()
+        return _batcher
+
+def spool_upload(source):
+    """Copies an upload to a temporary file; the caller removes it. Returns its path."""
+    with tempfile.NamedTemporaryFile(prefix='phoenix_upload_', delete=False) as f:
+        shutil.copyfileobj(source, f, UPLOAD_COPY_BYTES)
+    return f.name
+
+@app.post("/api/score")
+async def score_upload(file: UploadFile = File(..., description="CICIDS2017-format CSV (.csv, .csv.gz) or Parquet"),
+                       chunk_rows: int = Query(100000, ge=1000, le=1000000)):
+    """Scores an uploaded flow export chunk by chunk and streams the predictions back as CSV"""
+    import bulk_score
+    detector = await asyncio.to_thread(scoring_detector)
+    # The response outlives this handler, and with it the UploadFile (closed when the
+    # handler returns on some Starlette versions): stream from a copy the body owns
+    path = await asyncio.to_thread(spool_upload, file.file)
+    chunks = bulk_score.read_chunks(path, detector.features, chunk_rows, name=file.filename)
+    try:
+        # Read the first chunk here so a bad file is a 422, not a broken stream
+        first = await asyncio.to_thread(next, chunks, None)
+    except (ValueError, RuntimeError) as e:
+        chunks.close()
+        os.remove(path)
+        raise HTTPException(status_code=422, detail=f"{file.filename}: {e}")
+
+    def body():
+        try:
+            chunk, header = first, True
+            while chunk is not None:
+                result = bulk_score.score_chunk(detector, chunk)
+                yield bulk_score.csv_text(result, header)
+                chunk, header = next(chunks, None), False
+        finally:
+            chunks.close()
+            os.remove(path)
+
+    # Sync iterator: Starlette runs each step in a worker thread
+    name = os.path.basename(bulk_score.default_output(file.filename or "flows.csv"))
+    return StreamingResponse(body(), media_type="text/csv",
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.get("/api/model")
+async def model_info():
+    """Model inputs and classes for sensors using this server (model_server.RemoteDetector)"""
+    batcher = await asyncio.to_thread(model_batcher)
+    return batcher.info()
+
+@app.post("/api/predict")
+async def predict(request: Request, probabilities: bool = Query(False)):
+    """Scores a batch of feature vectors together with other callers' (see model_server.py)"""
+    import model_server
+    batcher = await asyncio.to_thread(model_batcher)
+    body = await request.body()
+    try:
+        X = model_server.decode_rows(body, request.headers.get('content-type', ''),
+                                     len(batcher.detector.features), request.headers.get('x-columns'))
+        future = batcher.submit(X, probabilities)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result = await asyncio.wrap_future(future)
+    return Response(model_server.result_json(batcher.detector, result), media_type="application/json")
+
+@app.get("/metrics")
+def metrics_text():
+    """Prometheus metrics of this process (model server batching)"""
+    import metrics
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file